@@ -1,125 +1,414 @@
-from flask import Flask, jsonify
-import asyncio
-import redis
+import time
+
+# measured against STARTUP_BUDGET once the module has loaded
+import_started = time.perf_counter()
+
+from quart import Quart, Response, jsonify, make_response, request, g
 import json
-from datetime import timedelta, datetime
 from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import math
 import os
-import requests
+import re
+import threading
 
 from constants import *
-from odds import get_odds, best_odds, arb_pairs
+import metrics
+from incremental import ARB_KINDS
 
-app = Flask(__name__)
+# ASGI app - run with `hypercorn app:app`; every route, Redis call and upstream fetch runs on
+# the worker's event loop, the executor only takes history appends
+app = Quart(__name__)
 executor = ThreadPoolExecutor()
-redis_client = redis.Redis(
-    host=os.environ['REDIS_HOST'],
-    port=6379,
-    password=os.environ['REDIS_PASSWORD'],
-    ssl=True,
+
+# the Redis client, key pool and pipeline are built on first use (or by the warm-up task) so a
+# cold worker answers health checks straight away - service pulls in numpy/zstd and the pipeline
+odds_service = None
+service_lock = threading.Lock()
+
+
+# The Odds API sport keys, e.g. icehockey_nhl
+SPORT_NAME = re.compile(r"[a-z0-9_]+")
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+def create_odds_service():
+    import redis.asyncio
+    from service import OddsService
+    from keys import KeyScheduler
+
+    redis_client = redis.asyncio.Redis(
+        host=os.environ['REDIS_HOST'],
+        port=6379,
+        password=os.environ['REDIS_PASSWORD'],
+        ssl=True,
+        socket_connect_timeout=REDIS_CONNECT_TIMEOUT,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        )
+
+    # load API key list
+    api_keys = json.loads(os.environ['ODDS_KEY_LIST'])
+    key_scheduler = KeyScheduler(redis_client, api_keys)
+
+    return OddsService(redis_client, executor, key_scheduler)
+
+
+# the shared OddsService, built on first call - a failed build is retried by the next caller
+def get_odds_service():
+    global odds_service
+    if odds_service is None:
+        with service_lock:
+            if odds_service is None:
+                try:
+                    odds_service = create_odds_service()
+                except Exception as e:
+                    raise ServiceUnavailable(f"Failed to initialize: {e}")
+    return odds_service
+
+
+# get_odds_service for the event loop - until the service is built, the build (imports included)
+# runs on a thread so the loop keeps serving
+async def load_odds_service():
+    if odds_service is not None:
+        return odds_service
+    return await asyncio.to_thread(get_odds_service)
+
+
+@app.errorhandler(ServiceUnavailable)
+async def service_unavailable(e):
+    print(e)
+    return jsonify({"error": str(e)}), 503
+
+
+startup_seconds = metrics.Gauge(
+    "arbapi_startup_seconds",
+    "Seconds from app import to loaded (import) and to Redis reachable with the pipeline built (ready)",
+    ["phase"],
+    )
+
+
+def record_startup(phase):
+    elapsed = time.perf_counter() - import_started
+    startup_seconds.set(elapsed, phase=phase)
+    if elapsed > STARTUP_BUDGET:
+        print(f"Startup {phase} took {elapsed:.2f}s, over the {STARTUP_BUDGET}s budget")
+
+
+# build the service and reach Redis in the background, retrying with backoff, so the first
+# request finds everything warm
+async def warm_up():
+    for attempt in range(STARTUP_RETRIES):
+        try:
+            # imports and builds off the loop so requests keep being served meanwhile
+            service = await load_odds_service()
+            await service.redis_client.ping()
+            record_startup("ready")
+            return
+        except Exception as e:
+            print(f"Warm-up attempt {attempt + 1} failed: {e}")
+            await asyncio.sleep(min(STARTUP_BACKOFF_BASE * 2 ** attempt, STARTUP_BACKOFF_MAX))
+
+
+request_latency = metrics.Histogram(
+    "arbapi_request_seconds",
+    "Time to serve each route, by response status",
+    ["route", "status"],
+    )
+metrics.Gauge(
+    "arbapi_executor_queue_depth",
+    "History appends waiting for a free executor thread",
+    function=lambda: executor._work_queue.qsize(),
     )
+# sampled cProfile of slow /odds requests, printed to the log
+profiled = metrics.profiled(PROFILE_SAMPLE_RATE, PROFILE_SLOW_SECONDS)
+
+
+# Quart hands sync functions to a thread pool - hooks and cheap routes stay async to skip the hop
+@app.before_request
+async def start_timer():
+    g.start = time.perf_counter()
+
+
+@app.after_request
+async def record_latency(response):
+    if request.url_rule is not None and 'start' in g:
+        request_latency.observe(time.perf_counter() - g.start, route=request.url_rule.rule, status=response.status_code)
+    return response
+
+
+# jsonify, timed as the serialize stage
+def timed_jsonify(data):
+    with metrics.span("serialize"):
+        return jsonify(data)
 
-# load API key list
-api_keys = json.loads(os.environ['ODDS_KEY_LIST'])
-current_key_index_key = "current_api_key_index"
 
-if not redis_client.exists(current_key_index_key):
-    redis_client.set(current_key_index_key, 0)
+@app.route('/')
+async def index():
+    return jsonify({"message": "Welcome to ArbAPI!"})
+
 
-def get_current_api_key():
-    index = int(redis_client.get(current_key_index_key))
-    return api_keys[index]
+# liveness - no dependencies touched
+@app.route('/health')
+async def health():
+    return jsonify({"status": "ok"})
 
-def rotate_api_key():
-    current_index = int(redis_client.get(current_key_index_key))
-    new_index = (current_index + 1) % len(api_keys)
-    redis_client.set(current_key_index_key, new_index)
-    print(f"Rotated API key to index {new_index}")
 
-# async function to offload get_odds
-async def async_get_odds(sport, market):
-    loop = asyncio.get_event_loop()
-    current_api_key = get_current_api_key()
+# readiness - the pipeline is built and Redis answers
+@app.route('/ready')
+async def ready():
     try:
-        return await loop.run_in_executor(executor, get_odds, sport, current_api_key, market, BOOKMAKERS)
+        service = await load_odds_service()
+        await service.redis_client.ping()
     except Exception as e:
-        print(f"Error fetching odds: {e}")
-        return None
+        return jsonify({"status": "unavailable", "error": str(e)}), 503
+    return jsonify({"status": "ready"})
 
 
-@app.route('/')
-def index():
+# outbound connectivity test: the public IP upstream requests leave from
+@app.route('/debug/egress-ip')
+async def egress_ip():
+    import httpx
+
     try:
-        response = requests.get('https://api.ipify.org?format=json')
+        async with httpx.AsyncClient(timeout=5) as client:
+            response = await client.get('https://api.ipify.org?format=json')
         response.raise_for_status()
         ip_info = response.json()
-        return jsonify({
-            "message": "Welcome to ArbAPI!",
-            "public_ip": ip_info.get('ip', 'Unavailable')
-        })
-    except requests.exceptions.RequestException as e:
-        return jsonify({
-            "message": "Welcome to ArbAPI!",
-            "error": f"Connectivity test failed: {e}"
-        }), 500
+        return jsonify({"public_ip": ip_info.get('ip', 'Unavailable')})
+    except httpx.HTTPError as e:
+        return jsonify({"error": f"Connectivity test failed: {e}"}), 500
+
+
+@app.route('/metrics')
+async def get_metrics():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 
 @app.route('/odds/raw/<sport>/<market>', methods=['GET'])
+@profiled
 async def get_raw_odds(sport, market):
-    cache_key = f'raw_odds_data_{sport}_{market}'
-    timestamp_key = f'{cache_key}_timestamp'
-
-    cached = redis_client.get(cache_key)
-    timestamp = redis_client.get(timestamp_key)
-
-    if cached:
-        response = json.loads(cached)
-        if isinstance(response, list):
-            response = {"data": response}  # Wrap list in a dictionary
-        timestamp = timestamp.decode('utf-8') if timestamp else None
-        response['timestamp'] = timestamp
-        return jsonify(response)
-
-    raw_odds = await async_get_odds(sport, market)
-    if raw_odds is None:
+    service = await load_odds_service()
+    raw_data = await service.raw(sport, market)
+    if raw_data is None:
         print("Failed to fetch raw odds.")
         return jsonify({"error": "Failed to fetch raw odds."}), 500
 
-    # Ensure raw_odds is a dictionary
-    if isinstance(raw_odds, list):
-        raw_odds = {"data": raw_odds}
-
-    # Check remaining requests and rotate API key if necessary
-    remaining_requests = raw_odds['data'][-2]["remaining_requests"]
-    print(f"Remaining requests: {remaining_requests}")
-    if remaining_requests == 0:
-       rotate_api_key()
-
-    # Dump raw_odds json into Redis cache
-    redis_client.setex(cache_key, timedelta(seconds=CACHE_TTL), json.dumps(raw_odds))
-    current_timestamp = datetime.utcnow().isoformat()
-    redis_client.setex(timestamp_key, timedelta(seconds=CACHE_TTL), current_timestamp)
-
-    raw_odds['timestamp'] = current_timestamp
-    return jsonify(raw_odds)
+    return timed_jsonify(raw_data)
 
 
 @app.route('/odds/best/<sport>/<market>', methods=['GET'])
+@profiled
 async def get_best_odds(sport, market):
-    raw_response = await get_raw_odds(sport, market)
-    raw_data = raw_response.get_json()
-    best_data = best_odds(raw_data["data"])  # Access the list from the dictionary
-    best_data = {"data": best_data, "timestamp": raw_data.get('timestamp')}
-    return jsonify(best_data)
+    service = await load_odds_service()
+    best_data = await service.best(sport, market)
+    if best_data is None:
+        print("Failed to fetch raw odds.")
+        return jsonify({"error": "Failed to fetch raw odds."}), 500
+
+    return timed_jsonify(best_data)
 
 
 @app.route('/odds/arb/<sport>/<market>', methods=['GET'])
+@profiled
 async def get_arb_pairs(sport, market):
-    best_response = await get_best_odds(sport, market)
-    best_data = best_response.get_json()
-    arb_data = arb_pairs(best_data["data"])  # Access the list from the dictionary
-    arb_data = {"data": arb_data, "timestamp": best_data.get('timestamp')}
-    return jsonify(arb_data)
+    service = await load_odds_service()
+    arb_data = await service.arb(sport, market)
+    if arb_data is None:
+        print("Failed to fetch raw odds.")
+        return jsonify({"error": "Failed to fetch raw odds."}), 500
+
+    return timed_jsonify(arb_data)
+
+
+# arbs opened, changed and closed by the last refresh of a sport/market
+@app.route('/odds/arb/<sport>/<market>/delta', methods=['GET'])
+async def get_arb_delta(sport, market):
+    service = await load_odds_service()
+    delta = await service.delta(sport, market)
+    if delta is None:
+        return jsonify({"error": "No refresh recorded yet."}), 404
+
+    return timed_jsonify(delta)
+
+
+# every market's arbs for a sport from a single upstream request
+@app.route('/odds/arb/<sport>/all', methods=['GET'])
+@profiled
+async def get_all_arb_pairs(sport):
+    service = await load_odds_service()
+    arb_data = await service.arb_all(sport)
+    if arb_data is None:
+        print("Failed to fetch raw odds.")
+        return jsonify({"error": "Failed to fetch raw odds."}), 500
+
+    return timed_jsonify(arb_data)
+
+
+# arbs across many sports/markets at once, e.g. /odds/arb/scan?sports=icehockey_nhl,basketball_nba&markets=h2h,totals
+@app.route('/odds/arb/scan', methods=['GET'])
+@profiled
+async def scan_arb_pairs():
+    sports = request.args.get('sports')
+    sports = list(dict.fromkeys(sports.split(','))) if sports else SCAN_SPORTS
+    markets = request.args.get('markets')
+    markets = markets.split(',') if markets else MARKETS
+
+    invalid = [market for market in markets if market not in MARKETS]
+    if invalid:
+        return jsonify({"error": f"Unsupported markets: {', '.join(invalid)}"}), 400
+    if len(sports) > SCAN_MAX_SPORTS:
+        return jsonify({"error": f"At most {SCAN_MAX_SPORTS} sports per scan."}), 400
+    invalid = [sport for sport in sports if not SPORT_NAME.fullmatch(sport)]
+    if invalid:
+        return jsonify({"error": f"Invalid sports: {', '.join(invalid)}"}), 400
+
+    service = await load_odds_service()
+    return timed_jsonify(await service.scan(sports, markets))
+
+
+
+# history reads page in memory-mapped files, so these stay sync and run on Quart's thread pool
+# snapshots fetched between start and end (ISO timestamps, UTC), oldest first, e.g.
+# /odds/history/icehockey_nhl/totals?start=2024-12-01T00:00:00&end=2024-12-02T00:00:00&limit=20
+@app.route('/odds/history/<sport>/<market>', methods=['GET'])
+def get_history(sport, market):
+    history = get_odds_service().history
+    if history is None:
+        return jsonify({"error": "History is disabled."}), 404
+    try:
+        limit = min(int(request.args.get('limit', HISTORY_QUERY_LIMIT)), HISTORY_QUERY_LIMIT)
+        if limit < 1:
+            raise ValueError("limit must be at least 1.")
+        board = history.board(sport, market)
+        snapshots = [snapshot.to_json() for snapshot in board.snapshots(request.args.get('start'), request.args.get('end'), limit)]
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return timed_jsonify({"data": snapshots, "count": len(snapshots)})
+
+
+# replay arb_pairs over the history between start and end: how often arbs appeared, how long each
+# lasted and which bookmaker pairs produced them (kind=low_hold_pairs/low_vig_pairs for the others).
+# At most limit snapshots are replayed - next_start continues the range
+@app.route('/odds/history/<sport>/<market>/arbs', methods=['GET'])
+def get_history_arbs(sport, market):
+    history = get_odds_service().history
+    if history is None:
+        return jsonify({"error": "History is disabled."}), 404
+    kind = request.args.get('kind', 'arb_pairs')
+    if kind not in ARB_KINDS:
+        return jsonify({"error": f"Unsupported kind: {kind}"}), 400
+    try:
+        limit = min(int(request.args.get('limit', HISTORY_REPLAY_LIMIT)), HISTORY_REPLAY_LIMIT)
+        if limit < 1:
+            raise ValueError("limit must be at least 1.")
+        board = history.board(sport, market)
+        summary = board.arb_summary(request.args.get('start'), request.args.get('end'), kind, limit)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    return timed_jsonify(summary)
+
+# ArbFilter from the sports, markets, bookmakers, kinds (comma-separated - the singular names work
+# too) and min_arb query args; ValueError names a bad filter
+def arb_filter_args():
+    from stream import ArbFilter
+
+    args = {name: request.args.get(name) or request.args.get(name[:-1]) for name in ('sports', 'markets', 'bookmakers', 'kinds')}
+    args = {name: value.split(',') if value else [] for name, value in args.items()}
+
+    invalid = [market for market in args['markets'] if market not in MARKETS]
+    invalid += [kind for kind in args['kinds'] if kind not in ARB_KINDS]
+    if invalid:
+        raise ValueError(f"Unsupported filters: {', '.join(invalid)}")
+
+    min_arb = request.args.get('min_arb')
+    try:
+        min_arb = float(min_arb) if min_arb else None
+    except ValueError:
+        raise ValueError("min_arb must be a number.") from None
+
+    return ArbFilter(args['sports'], args['markets'], args['bookmakers'], args['kinds'], min_arb)
+
+
+# arbs from the index every refresh maintains, best first - no boards fetched or recomputed, e.g.
+# /odds/arb/search?min_arb=0.5&bookmaker=fanduel&starts_within=6h&limit=50
+@app.route('/odds/arb/search', methods=['GET'])
+async def search_arb_pairs():
+    from arbindex import parse_duration
+
+    service = await load_odds_service()
+    if service.arb_index is None:
+        return jsonify({"error": "The arb index is disabled."}), 404
+    try:
+        arb_filter = arb_filter_args()
+        starts_within = request.args.get('starts_within')
+        starts_within = parse_duration(starts_within) if starts_within else None
+        limit = min(int(request.args.get('limit', ARB_SEARCH_LIMIT)), ARB_SEARCH_LIMIT)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    results = await service.search(arb_filter, starts_within, limit)
+    return timed_jsonify({"data": results, "count": len(results)})
+
+
+# stakes for every indexed arb at once - best margins filled first, within each leg's bet limit,
+# the bankroll and per-bookmaker balances, rounded to executable amounts, e.g.
+# /odds/arb/allocate?bankroll=5000&increment=5&sports=basketball_nba&starts_within=12h
+@app.route('/odds/arb/allocate', methods=['GET'])
+async def allocate_stakes():
+    from arbindex import parse_duration
+    from stakes import allocate
+
+    service = await load_odds_service()
+    if service.arb_index is None:
+        return jsonify({"error": "The arb index is disabled."}), 404
+    try:
+        arb_filter = arb_filter_args()
+        starts_within = request.args.get('starts_within')
+        starts_within = parse_duration(starts_within) if starts_within else None
+        bankroll = float(request.args.get('bankroll', BANKROLL))
+        increment = float(request.args.get('increment', STAKE_INCREMENT))
+        if not (math.isfinite(bankroll) and math.isfinite(increment) and bankroll > 0 and increment > 0):
+            raise ValueError("bankroll and increment must be positive numbers.")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    # only true arbs lock in a profit
+    arb_filter.kinds = {"arb_pairs"}
+
+    entries = await service.search(arb_filter, starts_within, ALLOCATE_MAX_ARBS)
+    with metrics.span("allocate"):
+        allocation = allocate(entries, bankroll, increment=increment)
+    return timed_jsonify(allocation)
+
+
+# live arbs as Server-Sent Events, pushed as each refresh opens, changes or closes them, e.g.
+# /odds/arb/stream?sports=icehockey_nhl&markets=h2h,totals&bookmakers=fanduel,draftkings&kinds=arb_pairs&min_arb=0.5
+@app.route('/odds/arb/stream', methods=['GET'])
+async def stream_arb_pairs():
+    try:
+        arb_filter = arb_filter_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    service = await load_odds_service()
+    response = await make_response(service.broadcaster.events(arb_filter),
+                                   {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # held open until the client disconnects
+    response.timeout = None
+    return response
+
+
+@app.before_serving
+async def start_warm_up():
+    if STARTUP_WARM_UP:
+        app.add_background_task(warm_up)
+
+
+record_startup("import")
 
 if __name__ == '__main__':
     app.run(debug=True)
\ No newline at end of file
@@ -0,0 +1,132 @@
+import re
+import time
+
+from constants import *
+from codec import encode, decode, CodecError
+from incremental import ARB_KINDS
+from odds import arb_percent, commence_epoch
+
+# replaces one board's entries in the index and drops entries from any board that hasn't been
+# refreshed before its expiry - one atomic step, so a search never sees half a board
+# KEYS[1] entries hash, KEYS[2] arb % sorted set, KEYS[3] commence time sorted set,
+# KEYS[4] expiry sorted set, KEYS[5] the board's member set
+# ARGV[1] now, ARGV[2] expiry for the new entries, then (member, arb %, commence time, entry) per entry
+UPDATE_SCRIPT = """
+local function drop(member)
+    redis.call('HDEL', KEYS[1], member)
+    redis.call('ZREM', KEYS[2], member)
+    redis.call('ZREM', KEYS[3], member)
+    redis.call('ZREM', KEYS[4], member)
+end
+for _, member in ipairs(redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', ARGV[1])) do
+    drop(member)
+end
+for _, member in ipairs(redis.call('SMEMBERS', KEYS[5])) do
+    drop(member)
+end
+redis.call('DEL', KEYS[5])
+for i = 3, #ARGV, 4 do
+    local member = ARGV[i]
+    redis.call('HSET', KEYS[1], member, ARGV[i + 3])
+    redis.call('ZADD', KEYS[2], ARGV[i + 1], member)
+    redis.call('ZADD', KEYS[3], ARGV[i + 2], member)
+    redis.call('ZADD', KEYS[4], ARGV[2], member)
+    redis.call('SADD', KEYS[5], member)
+end
+return (#ARGV - 2) / 4
+"""
+
+DURATION = re.compile(r"^(?P<value>\d+(\.\d+)?)(?P<unit>[smhd]?)$")
+DURATION_UNITS = {"": 1, "s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+
+
+# "90m", "6h", "2d" or plain seconds -> seconds
+def parse_duration(value):
+    match = DURATION.match(value.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid duration: {value}")
+    return float(match["value"]) * DURATION_UNITS[match["unit"]]
+
+
+# every board's arb/low-hold/low-vig entries in Redis, kept current by each refresh: sorted by arb %
+# and by commence time, so a search reads only the entries it might return instead of recomputing
+# or downloading whole boards. Shared by all workers - whichever one refreshes a board rewrites it
+class ArbIndex:
+    def __init__(self, redis_client, prefix="arb_index"):
+        self.redis_client = redis_client
+        self.prefix = prefix
+        self.entries_key = f"{prefix}_entries"
+        self.arb_key = f"{prefix}_arb"
+        self.commence_key = f"{prefix}_commence"
+        self.expiry_key = f"{prefix}_expiry"
+        self.update_script = redis_client.register_script(UPDATE_SCRIPT)
+
+    # sport|market|game|line - the board comes back out of the member without decoding the entry
+    @staticmethod
+    def member(sport, market, entry):
+        return f"{sport}|{market}|{entry['game_id']}|{entry.get('point', '')}"
+
+    # replace a board's indexed entries with the arb_pairs output of its latest snapshot, searchable
+    # for ttl seconds - as long as the board itself stays cached
+    async def update(self, snapshot, pairs, ttl):
+        now = time.time()
+        args = [now, now + ttl]
+        for kind in ARB_KINDS:
+            for entry in pairs[kind]:
+                args += [
+                    self.member(snapshot.sport, snapshot.market, entry),
+                    arb_percent(entry),
+                    commence_epoch(entry["commence_time"]),
+                    encode({"expires": now + ttl, "timestamp": snapshot.timestamp, "entry": {"kind": kind, **entry}}),
+                ]
+        board_key = f"{self.prefix}_{snapshot.sport}_{snapshot.market}"
+        return await self.update_script(
+            keys=[self.entries_key, self.arb_key, self.commence_key, self.expiry_key, board_key],
+            args=args,
+        )
+
+    # indexed entries matching an ArbFilter, best arb first; starts_within (seconds) keeps games
+    # commencing between now and then
+    async def search(self, arb_filter, starts_within=None, limit=ARB_SEARCH_LIMIT):
+        now = time.time()
+        upcoming = None
+        if starts_within is not None:
+            upcoming = set(await self.redis_client.zrangebyscore(self.commence_key, now, now + starts_within))
+            if not upcoming:
+                return []
+
+        low = arb_filter.min_arb if arb_filter.min_arb is not None else "-inf"
+        results = []
+        offset = 0
+        while len(results) < limit:
+            members = await self.redis_client.zrevrangebyscore(self.arb_key, "+inf", low, start=offset, num=ARB_SEARCH_PAGE)
+            if not members:
+                break
+            offset += len(members)
+
+            candidates = []
+            for member in members:
+                if upcoming is not None and member not in upcoming:
+                    continue
+                sport, market = member.decode("utf-8").split("|", 2)[:2]
+                if arb_filter.matches_board({"sport": sport, "market": market}):
+                    candidates.append(member)
+            if not candidates:
+                continue
+
+            for value in await self.redis_client.hmget(self.entries_key, candidates):
+                # dropped by a refresh between the two reads
+                if value is None:
+                    continue
+                try:
+                    indexed = decode(value)
+                except CodecError as e:
+                    print(f"Discarding indexed arb: {e}")
+                    continue
+                if indexed["expires"] < now or not arb_filter.matches(indexed["entry"]):
+                    continue
+                results.append({**indexed["entry"], "timestamp": indexed["timestamp"]})
+                if len(results) >= limit:
+                    break
+
+        return results
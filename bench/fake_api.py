@@ -0,0 +1,120 @@
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+from bench import fixtures
+
+ODDS_PATH = re.compile(r"^/v4/sports/(?P<sport>[^/]+)/odds$")
+
+
+# local stand-in for api.the-odds-api.com: serves a fixture for every sport's /odds with
+# configurable latency, and fails a fraction of requests with 429 or 5xx - each apiKey gets
+# its own quota, reported in x-requests-remaining like the real API
+class FakeOddsAPI:
+    def __init__(self, games, latency=0.0, jitter=0.0, rate_429=0.0, rate_5xx=0.0, port=0, seed=0, quota=10 ** 6):
+        self.games = games
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_5xx = rate_5xx
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.quota = quota
+        self.requests = 0
+        self.used = {}
+        self.statuses = {}
+        # encoded once per market combination - the stand-in shouldn't be the bottleneck
+        self.bodies = {}
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.handler())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address
+        return f"http://{host}:{port}"
+
+    def body(self, markets):
+        markets = tuple(sorted(markets))
+        if markets not in self.bodies:
+            self.bodies[markets] = json.dumps(fixtures.filter_markets(self.games, markets)).encode()
+        return self.bodies[markets]
+
+    def respond(self, path, query):
+        match = ODDS_PATH.match(path)
+        if not match:
+            return 404, {}, b'{"message": "Not found"}'
+
+        api_key = query.get("apiKey")
+        with self.lock:
+            self.requests += 1
+            used = self.used[api_key] = self.used.get(api_key, 0) + 1
+            roll = self.random.random()
+            delay = max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0)
+        time.sleep(delay)
+
+        headers = {"x-requests-remaining": str(max(self.quota - used, 0)), "x-requests-used": str(used)}
+        if roll < self.rate_429 or used > self.quota:
+            return 429, headers, b'{"message": "Usage quota has been reached"}'
+        if roll < self.rate_429 + self.rate_5xx:
+            return 503, headers, b'{"message": "Service unavailable"}'
+
+        markets = query.get("markets", "h2h").split(",")
+        return 200, headers, self.body(markets)
+
+    def handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def do_GET(self):
+                path, _, query = self.path.partition("?")
+                query = dict(parse_qsl(query))
+                status, headers, body = api.respond(path, query)
+                with api.lock:
+                    api.statuses[status] = api.statuses.get(status, 0) + 1
+
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name="fake-odds-api", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve a fixture as The Odds API on localhost")
+    parser.add_argument("--fixture", default="medium")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--rate-5xx", type=float, default=0.0)
+    args = parser.parse_args()
+
+    api = FakeOddsAPI(fixtures.load(args.fixture), args.latency, args.jitter, args.rate_429, args.rate_5xx, args.port)
+    print(f"Fake Odds API on {api.url} - set ODDS_API_BASE_URL={api.url}")
+    api.server.serve_forever()
@@ -0,0 +1,216 @@
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+# python -m bench.run [--fixtures small,medium] [--save bench/baseline.json | --compare bench/baseline.json]
+parser = argparse.ArgumentParser(description="Benchmark the odds pipeline and routes against a local fake Odds API")
+parser.add_argument("--fixtures", default="small,medium,large", help="sizes from bench/fixtures.py or recorded fixture names")
+parser.add_argument("--seconds", type=float, default=1.0, help="time budget per stage")
+parser.add_argument("--requests", type=int, default=200, help="requests per route scenario")
+parser.add_argument("--concurrency", type=int, default=8)
+parser.add_argument("--port", type=int, default=8099, help="port for the fake Odds API")
+parser.add_argument("--latency", type=float, default=0.05, help="fake upstream latency in seconds")
+parser.add_argument("--jitter", type=float, default=0.01)
+parser.add_argument("--rate-429", type=float, default=0.0)
+parser.add_argument("--rate-5xx", type=float, default=0.0)
+parser.add_argument("--save", help="write results to this file as the new baseline")
+parser.add_argument("--compare", help="baseline file to compare against - exits 1 on a regression")
+parser.add_argument("--threshold", type=float, default=0.2, help="allowed slowdown vs the baseline, as a fraction")
+args = parser.parse_args()
+
+# point the app at the stand-in API and an in-process Redis before anything imports it
+os.environ["ODDS_API_BASE_URL"] = f"http://127.0.0.1:{args.port}"
+os.environ.setdefault("REDIS_HOST", "localhost")
+os.environ.setdefault("REDIS_PASSWORD", "")
+os.environ.setdefault("ODDS_KEY_LIST", json.dumps([f"bench-key-{i}" for i in range(20)]))
+
+import fakeredis
+import redis.asyncio
+
+redis_server = fakeredis.FakeServer()
+
+
+class BenchRedis(fakeredis.FakeAsyncRedis):
+    def __init__(self, host=None, port=None, password=None, ssl=None, **kwargs):
+        super().__init__(server=redis_server, **kwargs)
+
+
+redis.asyncio.Redis = BenchRedis
+
+from constants import *
+import codec
+import odds
+import upstream
+from bench import fixtures
+from bench.fake_api import FakeOddsAPI
+from compute import compute_arbs
+from engine import OddsBoard
+from incremental import ArbTracker
+from models import Snapshot, parse_snapshots
+
+SPORT = "icehockey_nhl"
+
+# one loop for the whole run, so the upstream client keeps its pooled connections between calls
+loop = asyncio.new_event_loop()
+run = loop.run_until_complete
+
+
+def best_only(*args):
+    return parse_snapshots(*args, best_only=True)
+
+
+# ops/sec over the time budget plus peak traced allocation of one call; setup (untimed) builds
+# fresh inputs for every call
+def measure(function, setup=None, seconds=args.seconds):
+    inputs = setup() if setup else ()
+    tracemalloc.start()
+    function(*inputs)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    calls = 0
+    elapsed = 0.0
+    while elapsed < seconds or calls < 3:
+        inputs = setup() if setup else ()
+        start = time.perf_counter()
+        function(*inputs)
+        elapsed += time.perf_counter() - start
+        calls += 1
+    return {"ops_per_sec": round(calls / elapsed, 2), "peak_kb": round(peak / 1024, 1)}
+
+
+# per-stage throughput for one fixture, each stage fed by the previous one's output
+def bench_stages():
+    processed = run(odds.get_odds_multi(SPORT, "bench-stage", MARKETS, BOOKMAKERS))
+    results = {
+        "fetch_parse": measure(lambda: run(odds.get_odds_multi(SPORT, "bench-stage", MARKETS, BOOKMAKERS))),
+        "fetch_parse.fused": measure(lambda: run(odds.fetch_odds(SPORT, "bench-stage", MARKETS, BOOKMAKERS, None, parse_snapshots))),
+        "fetch_parse.best_only": measure(lambda: run(odds.fetch_odds(SPORT, "bench-stage", MARKETS, BOOKMAKERS, None, best_only))),
+    }
+
+    for market in MARKETS:
+        raw = processed[market]
+        blob = codec.encode({"data": raw})
+        best = odds.best_odds(raw)
+        snapshot = lambda: (Snapshot.from_processed(raw),)
+
+        tracker = ArbTracker()
+        previous = Snapshot.from_processed(raw)
+        tracker.update(previous)
+
+        results.update({
+            f"{market}.snapshot": measure(lambda: Snapshot.from_processed(raw)),
+            f"{market}.best_odds.python": measure(lambda: odds.best_odds(raw)),
+            f"{market}.best_odds.snapshot": measure(lambda s: s.best_odds(), snapshot),
+            f"{market}.arb_pairs.python": measure(lambda: odds.arb_pairs(best)),
+            f"{market}.arb_pairs.snapshot": measure(lambda s: s.arb_pairs(), snapshot),
+            f"{market}.arb_pairs.numpy": measure(lambda s: OddsBoard(s).arb_pairs(), snapshot),
+            f"{market}.arb_pairs.incremental": measure(lambda s: tracker.update(s, previous), snapshot),
+            # what one board costs a pool worker, decode and result encoding included
+            f"{market}.arb_pairs.pool_task": measure(lambda: compute_arbs([blob])),
+            f"{market}.encode": measure(lambda: codec.encode({"data": raw})),
+            f"{market}.decode": measure(lambda: codec.decode(blob)),
+        })
+    return results
+
+
+# p50/p99 latency and throughput of each route through Quart with concurrent clients on one event
+# loop, on a warm cache (hit) and on a sport nothing has cached yet (miss - one upstream fetch per request)
+async def bench_routes(app, fixture):
+    results = {}
+    client = app.app.test_client()
+
+    for route in ("raw", "best", "arb"):
+        for scenario in ("hit", "miss"):
+            await client.get(f"/odds/{route}/{SPORT}/totals")
+            semaphore = asyncio.Semaphore(args.concurrency)
+
+            async def request(i):
+                sport = SPORT if scenario == "hit" else f"{SPORT}_{fixture}_{route}_{i}"
+                async with semaphore:
+                    start = time.perf_counter()
+                    status = (await client.get(f"/odds/{route}/{sport}/totals")).status_code
+                    return time.perf_counter() - start, status
+
+            start = time.perf_counter()
+            samples = await asyncio.gather(*[request(i) for i in range(args.requests)])
+            elapsed = time.perf_counter() - start
+
+            latencies = sorted(latency for latency, _ in samples)
+            results[f"{route}.{scenario}"] = {
+                "p50_ms": round(statistics.median(latencies) * 1000, 3),
+                "p99_ms": round(latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)] * 1000, 3),
+                "rps": round(len(samples) / elapsed, 2),
+                "errors": sum(status != 200 for _, status in samples),
+            }
+    return results
+
+
+# metrics where the new result is more than threshold worse than the baseline
+def regressions(baseline, results, threshold):
+    found = []
+    for fixture, sections in results.items():
+        if not isinstance(sections, dict):
+            continue
+        for section in ("stages", "routes"):
+            for name, values in sections[section].items():
+                old = baseline.get(fixture, {}).get(section, {}).get(name)
+                if not old:
+                    continue
+                for metric, value in values.items():
+                    before = old.get(metric)
+                    if not before or metric in ("errors", "peak_kb"):
+                        continue
+                    # throughput should not drop, latency should not grow
+                    change = (before - value) / before if metric in ("ops_per_sec", "rps") else (value - before) / before
+                    if change > threshold:
+                        found.append(f"{fixture} {section} {name} {metric}: {before} -> {value} ({change:.0%} worse)")
+    return found
+
+
+def main():
+    import app
+
+    results = {}
+    for name in args.fixtures.split(","):
+        api = FakeOddsAPI(fixtures.load(name), 0.0, 0.0, port=args.port).start()
+        print(f"[{name}] stages", file=sys.stderr)
+        stages = bench_stages()
+        api.stop()
+        # keep-alive connections would otherwise keep talking to the stopped server's handler threads
+        run(upstream.close())
+
+        api = FakeOddsAPI(fixtures.load(name), args.latency, args.jitter, args.rate_429, args.rate_5xx, port=args.port).start()
+        print(f"[{name}] routes", file=sys.stderr)
+        routes = run(bench_routes(app, name))
+        api.stop()
+        run(upstream.close())
+
+        service = app.get_odds_service()
+        run(service.redis_client.flushall())
+        service.l1_cache.entries.clear()
+        results[name] = {"stages": stages, "routes": routes, "upstream_statuses": dict(api.statuses)}
+
+    results["max_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    print(json.dumps(results, indent=2))
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            found = regressions(json.load(f), results, args.threshold)
+        for regression in found:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
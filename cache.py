@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+# coalesces concurrent fetches so only one fetch per key is in progress in this process
+class SingleFlight:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    # returns a future for every key, plus the keys the caller now owns and must resolve
+    def claim(self, keys):
+        with self.lock:
+            owned = [key for key in keys if key not in self.calls]
+            for key in owned:
+                self.calls[key] = Future()
+            return {key: self.calls[key] for key in keys}, owned
+
+    # the key is released first, so a future a waiter already gave up on can't keep it claimed
+    def resolve(self, key, result):
+        with self.lock:
+            future = self.calls.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(result)
+
+    # a claimed key's result from the running loop, None after timeout seconds - shielded so a
+    # waiter timing out or disconnecting never cancels the future the other callers share
+    async def wait(self, future, timeout):
+        try:
+            return await asyncio.wait_for(asyncio.shield(asyncio.wrap_future(future)), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+# bounded in-process cache with per-entry TTL and least-recently-used eviction
+class LRUCache:
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            # expired entries stay until evicted so peek can still revalidate them
+            if expires_at < time.monotonic():
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    # value even if expired, without touching recency - for revalidating against the source
+    def peek(self, key):
+        with self.lock:
+            item = self.entries.get(key)
+            return item[1] if item else None
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+# background task that re-fetches recently requested (sport, market) keys shortly before they expire
+class RefreshAhead:
+    def __init__(self, refresh, interval, hot_window):
+        # await refresh(pairs) is run on the serving event loop with every hot (sport, market) pair
+        self.refresh = refresh
+        self.interval = interval
+        self.hot_window = hot_window
+        self.lock = threading.Lock()
+        self.last_access = {}
+        self.task = None
+
+    # called from a coroutine - the task is started on the running loop the first time
+    def touch(self, sport, market):
+        with self.lock:
+            self.last_access[(sport, market)] = time.monotonic()
+            # started lazily so it is never forked along with a preloaded app
+            if self.task is None:
+                self.task = asyncio.get_running_loop().create_task(self.run())
+
+    def hot_pairs(self):
+        cutoff = time.monotonic() - self.hot_window
+        with self.lock:
+            for pair, last_access in list(self.last_access.items()):
+                if last_access < cutoff:
+                    del self.last_access[pair]
+            return list(self.last_access)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            pairs = self.hot_pairs()
+            if not pairs:
+                continue
+            try:
+                await self.refresh(pairs)
+            except Exception as e:
+                print(f"Refresh-ahead failed: {e}")
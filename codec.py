@@ -0,0 +1,90 @@
+import json
+import threading
+import time
+import zlib
+
+import orjson
+import zstandard
+
+from constants import *
+from metrics import Counter, Histogram
+
+# first byte of every encoded cache value - legacy entries are bare JSON and start with '{' or '['
+CODEC_JSON = 1
+CODEC_ZLIB = 2
+CODEC_ZSTD = 3
+CODECS = {"json": CODEC_JSON, "zlib": CODEC_ZLIB, "zstd": CODEC_ZSTD}
+
+cache_bytes = Counter(
+    "arbapi_cache_bytes_total",
+    "Bytes of cache values written, as JSON (raw) and as stored (encoded)",
+    ["form"],
+    )
+cache_decode_latency = Histogram(
+    "arbapi_cache_decode_seconds",
+    "Time to decode a cache value, by codec",
+    ["codec"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25),
+    )
+
+
+# value can't be decoded: unknown version byte or a corrupt payload - callers treat it as a miss
+class CodecError(Exception):
+    pass
+
+
+# zstd contexts aren't thread safe, so each thread keeps its own
+local = threading.local()
+
+
+def zstd_compressor():
+    if not hasattr(local, "compressor"):
+        local.compressor = zstandard.ZstdCompressor(level=CACHE_COMPRESSION_LEVEL)
+    return local.compressor
+
+
+def zstd_decompressor():
+    if not hasattr(local, "decompressor"):
+        local.decompressor = zstandard.ZstdDecompressor()
+    return local.decompressor
+
+
+# value -> bytes for Redis: version byte + orjson, compressed unless codec is "json"
+def encode(value, codec=CACHE_CODEC) -> bytes:
+    raw = orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS)
+    version = CODECS[codec]
+    payload = raw
+    if version == CODEC_ZLIB:
+        payload = zlib.compress(raw, CACHE_COMPRESSION_LEVEL)
+    elif version == CODEC_ZSTD:
+        payload = zstd_compressor().compress(raw)
+    encoded = bytes([version]) + payload
+
+    cache_bytes.inc(len(raw), form="raw")
+    cache_bytes.inc(len(encoded), form="encoded")
+    return encoded
+
+
+# bytes from Redis -> value, reading every version this or an older deploy wrote
+def decode(data):
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    if not data:
+        raise CodecError("empty cache value")
+    start = time.perf_counter()
+    version = data[0]
+    try:
+        if version in (ord("{"), ord("[")):
+            codec, value = "legacy", json.loads(data)
+        elif version == CODEC_JSON:
+            codec, value = "json", orjson.loads(data[1:])
+        elif version == CODEC_ZLIB:
+            codec, value = "zlib", orjson.loads(zlib.decompress(data[1:]))
+        elif version == CODEC_ZSTD:
+            codec, value = "zstd", orjson.loads(zstd_decompressor().decompress(data[1:]))
+        else:
+            raise CodecError(f"unknown cache codec version {version}")
+    except (ValueError, zlib.error, zstandard.ZstdError) as e:
+        raise CodecError(f"corrupt cache value: {e}")
+    cache_decode_latency.observe(time.perf_counter() - start, codec=codec)
+    return value
@@ -0,0 +1,52 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import orjson
+
+from constants import *
+from codec import decode
+from models import Snapshot
+
+
+# runs in a pool process: each board as the cache stores it (codec bytes) -> its arb_pairs as orjson
+# bytes - both ways a flat byte string instead of a pickled tree of dicts
+def compute_arbs(blobs):
+    if ODDS_ENGINE == "numpy":
+        from engine import OddsBoard
+
+    results = []
+    for blob in blobs:
+        processed = decode(blob)
+        if isinstance(processed, dict):
+            processed = processed["data"]
+        snapshot = Snapshot.from_processed(processed)
+        pairs = OddsBoard(snapshot).arb_pairs() if ODDS_ENGINE == "numpy" else snapshot.arb_pairs()
+        results.append(orjson.dumps(pairs, option=orjson.OPT_NON_STR_KEYS))
+    return results
+
+
+# process pool for best/arb work too big to run on the event loop - refreshed and scanned boards
+# are computed on other cores while the loop keeps serving requests
+class ComputePool:
+    def __init__(self, workers=COMPUTE_WORKERS):
+        self.workers = workers
+        self.pool = None
+
+    # started on first use with spawn, so workers never inherit the serving loop's threads and sockets
+    def executor(self):
+        if self.pool is None:
+            self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self.pool
+
+    # arb_pairs for each encoded board, in order
+    async def arbs(self, blobs):
+        loop = asyncio.get_running_loop()
+        try:
+            results = await loop.run_in_executor(self.executor(), compute_arbs, blobs)
+        except BrokenProcessPool:
+            # a worker died - the next call starts a fresh pool
+            self.pool = None
+            raise
+        return [orjson.loads(result) for result in results]
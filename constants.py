@@ -1,3 +1,6 @@
+import json
+import os
+
 # TTL in seconds - 5 minutes
 CACHE_TTL = 5 * 60
 
@@ -14,3 +17,164 @@ BOOKMAKERS =  [
     'betvictor',
     'pointsbetau'
     ]
+
+# markets fetched together by /odds/arb/<sport>/all
+MARKETS = ['h2h', 'totals', 'spreads']
+
+# leagues covered by /odds/arb/scan when no sports are given
+SCAN_SPORTS = [
+    'americanfootball_nfl',
+    'americanfootball_ncaaf',
+    'basketball_nba',
+    'basketball_ncaab',
+    'basketball_wnba',
+    'baseball_mlb',
+    'icehockey_nhl',
+    'soccer_epl',
+    'soccer_uefa_champs_league',
+    'soccer_usa_mls',
+    'mma_mixed_martial_arts',
+    'boxing_boxing',
+    'tennis_atp_us_open',
+    'aussierules_afl',
+    'rugbyleague_nrl',
+    ]
+
+# max upstream requests in flight during a scan, and seconds to wait on each
+SCAN_CONCURRENCY = 8
+SCAN_TIMEOUT = 20
+# most sports one scan may name - each is an upstream fetch, kept refreshed while it stays hot
+SCAN_MAX_SPORTS = len(SCAN_SPORTS)
+
+# The Odds API base URL - overridable so the benchmarks can point it at a local stand-in
+ODDS_API_BASE_URL = os.environ.get("ODDS_API_BASE_URL", "https://api.the-odds-api.com")
+
+# upstream HTTP client - seconds to connect/read, pooled keep-alive connections per worker
+UPSTREAM_CONNECT_TIMEOUT = 3.05
+UPSTREAM_READ_TIMEOUT = 15
+UPSTREAM_POOL_SIZE = 16
+
+# retries on 5xx/connection errors, jittered backoff in seconds
+UPSTREAM_RETRIES = 2
+UPSTREAM_BACKOFF_BASE = 0.25
+UPSTREAM_BACKOFF_MAX = 2
+# each request earns RATIO retries, banked up to CAPACITY
+UPSTREAM_RETRY_RATIO = 0.2
+UPSTREAM_RETRY_CAPACITY = 10
+
+# adaptive TTL (schedule.py): each refresh picks its board's TTL from how soon the next game starts
+# - (seconds until it starts, TTL) tiers, the first one it falls under wins, TTL_MAX past the last -
+# then scales it by how many lines moved: a smoothed changed share of TARGET keeps the tier's TTL,
+# less stretches it and more shrinks it, by up to VOLATILITY_MAX_STRETCH either way. Below
+# TTL_BUDGET_COMFORT requests left across the key pool TTLs stretch, up to BUDGET_MAX_STRETCH.
+# CACHE_TTL applies with ADAPTIVE_TTL off
+ADAPTIVE_TTL = True
+TTL_BY_COMMENCE = [(60 * 60, 60), (6 * 60 * 60, 2 * 60), (24 * 60 * 60, 5 * 60), (3 * 24 * 60 * 60, 15 * 60)]
+TTL_MIN = 60
+TTL_MAX = 30 * 60
+TTL_VOLATILITY_TARGET = 0.2
+TTL_VOLATILITY_SMOOTHING = 0.3
+TTL_VOLATILITY_MAX_STRETCH = 2
+TTL_BUDGET_COMFORT = 1000
+TTL_BUDGET_MAX_STRETCH = 4
+
+# refresh only the games starting within FETCH_WINDOW seconds (commenceTimeTo), keeping the cached
+# games past it, as long as those were fetched in the last FETCH_FULL_INTERVAL seconds
+FETCH_WINDOW_ENABLED = True
+FETCH_WINDOW = 24 * 60 * 60
+FETCH_FULL_INTERVAL = 30 * 60
+
+# seconds expired odds stay in Redis to be served while a refresh is in flight
+CACHE_STALE_TTL = 10 * 60
+# per-market fetch lock shared by workers: lock expiry - long enough for a fetch that times out on
+# every retry - how long to wait on another worker's fetch, poll interval
+CACHE_LOCK_TTL = int((UPSTREAM_RETRIES + 1) * (UPSTREAM_CONNECT_TIMEOUT + UPSTREAM_READ_TIMEOUT) + UPSTREAM_RETRIES * UPSTREAM_BACKOFF_MAX) + 1
+CACHE_LOCK_WAIT = 10
+CACHE_LOCK_POLL = 0.2
+
+# refresh-ahead: re-fetch keys requested in the last REFRESH_HOT_WINDOW seconds once they are
+# within REFRESH_AHEAD seconds of CACHE_TTL, checking every REFRESH_CHECK_INTERVAL seconds
+REFRESH_AHEAD_ENABLED = True
+REFRESH_AHEAD = 30
+REFRESH_CHECK_INTERVAL = 10
+REFRESH_HOT_WINDOW = 15 * 60
+
+# per-worker L1 cache of decoded odds: max (sport, market) entries, seconds before revalidating against Redis
+L1_MAX_ENTRIES = 256
+L1_TTL = 15
+
+# best/arb engine: "numpy" (vectorized, engine.py) or "python" (per-line walk over the Snapshot, models.py)
+ODDS_ENGINE = "numpy"
+
+# where arbs for many boards at once are computed - a fetch's refreshed boards, or the cached boards
+# of a scan or /all: "process" sends them to a pool of COMPUTE_WORKERS processes, one task per
+# sport, once they add up to COMPUTE_MIN_LINES lines; "inline" computes them on the event loop.
+# Each hypercorn worker starts its own pool, so workers x COMPUTE_WORKERS should stay within the cores
+COMPUTE_MODE = os.environ.get("COMPUTE_MODE", "inline")
+COMPUTE_WORKERS = int(os.environ.get("COMPUTE_WORKERS", 2))
+COMPUTE_MIN_LINES = 500
+
+# recompute arbs only for lines whose bookmakers changed since the last fetch, and record the delta
+INCREMENTAL_ARBS = True
+
+# live arb stream: Redis pub/sub channel refresh deltas go out on, events buffered per client
+# before a slow client is dropped, seconds between keep-alives
+ARB_STREAM_CHANNEL = "arb_stream"
+ARB_STREAM_QUEUE_SIZE = 100
+ARB_STREAM_HEARTBEAT = 15
+
+# searchable arb index in Redis (arbindex.py), rewritten per board on each refresh and kept as long
+# as the board stays cached: most results one /odds/arb/search returns, and entries read per page
+# while filtering
+ARB_INDEX_ENABLED = True
+ARB_SEARCH_LIMIT = 100
+ARB_SEARCH_PAGE = 200
+
+# batch stake allocation (stakes.py): bankroll split across every indexed arb, per-bookmaker balances
+# (Odds API key as in BOOKMAKERS -> amount, books left out draw only on the bankroll), per-bookmaker max stake per bet
+# for legs the feed reports no bet_limit on (DEFAULT_BET_LIMIT for the rest, None for no cap),
+# stakes rounded down to STAKE_INCREMENT, and the most arbs read from the index per allocation
+BANKROLL = 1000
+BOOKMAKER_BALANCES = json.loads(os.environ.get("BOOKMAKER_BALANCES", "{}"))
+BOOKMAKER_BET_LIMITS = {}
+DEFAULT_BET_LIMIT = None
+STAKE_INCREMENT = 1
+ALLOCATE_MAX_ARBS = 500
+
+# API key scheduler: requests a worker's key lease covers and how long it lasts, budget assumed for
+# keys not seen yet, seconds exhausted (429/0 left) and invalid (401) keys are skipped
+KEY_LEASE_REQUESTS = 5
+KEY_LEASE_SECONDS = 30
+KEY_DEFAULT_REMAINING = 500
+KEY_EXHAUSTED_COOLDOWN = 60 * 60
+KEY_INVALID_COOLDOWN = 24 * 60 * 60
+# seconds a worker reuses its read of the pool's total remaining requests
+KEY_BUDGET_CACHE_SECONDS = 30
+
+# Redis value encoding: "zstd", "zlib" or "json" (uncompressed); values written by older deploys as
+# plain JSON are still read
+CACHE_CODEC = "zstd"
+CACHE_COMPRESSION_LEVEL = 3
+
+# fraction of /odds requests profiled with cProfile, and how slow (seconds) one must be for its profile to be logged
+PROFILE_SAMPLE_RATE = 0
+PROFILE_SLOW_SECONDS = 1
+
+# append every fetched snapshot to the on-disk history store (history.py) under HISTORY_DIR, the
+# most snapshots one /history request returns, and the most one /history/.../arbs request replays
+HISTORY_ENABLED = True
+HISTORY_DIR = os.environ.get("HISTORY_DIR", "history")
+HISTORY_QUERY_LIMIT = 100
+HISTORY_REPLAY_LIMIT = 2000
+
+# Redis connect and per-command socket timeouts, seconds
+REDIS_CONNECT_TIMEOUT = 5
+REDIS_SOCKET_TIMEOUT = 10
+
+# cold start: seconds import/ready may take before a warning is logged, and the background warm-up
+# that builds the pipeline and reaches Redis - attempts and backoff between them
+STARTUP_BUDGET = 5
+STARTUP_WARM_UP = True
+STARTUP_RETRIES = 8
+STARTUP_BACKOFF_BASE = 0.5
+STARTUP_BACKOFF_MAX = 10
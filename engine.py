@@ -0,0 +1,93 @@
+import numpy as np
+
+from odds import format_arb_data
+
+
+# columnar view of one market snapshot for vectorized best/arb: rows are every (game, line),
+# columns the bookmakers quoting that line in feed order, and the last axis the two outcomes
+# (home/Over, away/Under)
+class OddsBoard:
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+        # per row: the game and line it came from
+        self.row_game = []
+        self.row_line = []
+        prices = []
+
+        for game, line in snapshot.board_lines():
+            self.row_game.append(game)
+            self.row_line.append(line)
+            prices.append([quote.prices for quote in line.quotes])
+
+        n_cols = max((len(quotes) for quotes in prices), default=0)
+        # -inf marks a missing quote so it never wins the argmax
+        self.prices = np.full((len(prices), max(n_cols, 1), 2), -np.inf)
+        for row, quotes in enumerate(prices):
+            if quotes:
+                self.prices[row, :len(quotes)] = quotes
+
+        # best price per row/outcome - argmax takes the first bookmaker on ties, like the dict walk
+        self.best_col = self.prices.argmax(axis=1)
+        self.has_best = np.isfinite(self.prices).any(axis=1)
+        self.best_price = np.take_along_axis(self.prices, self.best_col[:, None, :], axis=1)[:, 0, :]
+
+        # hand the winning quotes back to the lines so the snapshot formats them without another walk
+        for row, line in enumerate(self.row_line):
+            best_a, best_b = self.best_col[row].tolist()
+            has_a, has_b = self.has_best[row].tolist()
+            line.best = (line.quotes[best_a] if has_a else None, line.quotes[best_b] if has_b else None)
+
+    # same output as odds.best_odds
+    def best_odds(self) -> list:
+        return self.snapshot.best_odds()
+
+    # same output as odds.arb_pairs(odds.best_odds(...)) - implied probabilities, arb values and
+    # stakes for every line in one pass, dicts built only for the lines that make the cut
+    def arb_pairs(self, total_stake: float = 1000) -> dict:
+        snapshot = self.snapshot
+        pairs = {"arb_pairs": [], "low_hold_pairs": [], "low_vig_pairs": []}
+
+        complete = self.has_best.all(axis=1)
+        decimal = np.where(self.has_best, self.best_price, 1.0)
+        implied = 1 / decimal
+        arb_value = implied[:, 0] + implied[:, 1]
+
+        stake = total_stake * implied / arb_value[:, None]
+        # weighted bets: win on one outcome, break even on the other
+        break_even = total_stake / decimal
+        weighted_a = np.stack([total_stake - break_even[:, 1], break_even[:, 1]], axis=1)
+        weighted_b = np.stack([break_even[:, 0], total_stake - break_even[:, 0]], axis=1)
+
+        kinds = np.select(
+            [complete & (arb_value < 1), complete & (arb_value == 1), complete & (arb_value > 1) & (arb_value < 1.01)],
+            [0, 1, 2],
+            -1,
+        )
+
+        for row in np.flatnonzero(kinds >= 0).tolist():
+            game, line = self.row_game[row], self.row_line[row]
+            arb_data = {
+                "arb": f"{round(-(arb_value[row].item() - 1) * 100, 3)}%",
+                "arb_amount": {
+                    "outcome_a": round(stake[row, 0].item(), 2),
+                    "outcome_b": round(stake[row, 1].item(), 2)
+                },
+                "weighted_amounts_a": {
+                    "outcome_a": round(weighted_a[row, 0].item(), 2),
+                    "outcome_b": round(weighted_a[row, 1].item(), 2)
+                },
+                "weighted_amounts_b": {
+                    "outcome_a": round(weighted_b[row, 0].item(), 2),
+                    "outcome_b": round(weighted_b[row, 1].item(), 2)
+                }
+            }
+            point = line.key if snapshot.market != "h2h" else None
+            kind = ("arb_pairs", "low_hold_pairs", "low_vig_pairs")[kinds[row]]
+            pairs[kind].append(format_arb_data(
+                game.game_id, snapshot.sport, snapshot.market, game.home_team, game.away_team,
+                game.commence_time, arb_data, snapshot.best_line(game, line), point
+            ))
+
+        pairs["metadata"] = snapshot.metadata()
+        return pairs
@@ -0,0 +1,258 @@
+import fcntl
+import json
+import math
+import os
+import re
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import numpy as np
+
+from constants import *
+from models import Snapshot, Game, Line, BookQuote
+
+# one row per bookmaker quote; strings are ids into the board's string dictionary
+ROW_DTYPE = np.dtype([
+    ("game", "<u4"),
+    ("home", "<u4"),
+    ("away", "<u4"),
+    ("commence", "<u4"),
+    ("line", "<u4"),
+    ("bookmaker", "<u4"),
+    ("last_update", "<u4"),
+    ("link", "<u4"),
+    ("sid", "<u4"),
+    ("price", "<f8", (2,)),
+    ("point", "<f8", (2,)),
+])
+# one record per appended snapshot - the rows it owns and when it was fetched (epoch seconds)
+SNAPSHOT_DTYPE = np.dtype([
+    ("fetched", "<f8"),
+    ("start", "<u8"),
+    ("count", "<u4"),
+    ("remaining", "<u4"),
+    ("bookmakers", "<u4"),
+])
+# line id of the placeholder row kept for a game nobody quoted
+NO_LINE = np.iinfo(np.uint32).max
+
+BOARD_NAME = re.compile(r"[A-Za-z0-9_]+")
+
+
+def to_epoch(timestamp: str) -> float:
+    return datetime.fromisoformat(timestamp).replace(tzinfo=timezone.utc).timestamp()
+
+
+def from_epoch(epoch: float) -> str:
+    return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None).isoformat()
+
+
+# a fixed-width array file that is only ever appended to, read through a memory map
+def read_array(path, dtype):
+    size = os.path.getsize(path) if os.path.exists(path) else 0
+    count = size // dtype.itemsize
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+
+# every snapshot of one sport/market: rows.bin and snapshots.bin hold fixed-width columns,
+# strings.jsonl the string dictionary (one JSON value per line, id = line number). Rows are
+# written before the snapshot record that points at them, so readers never see half an append
+class BoardHistory:
+    def __init__(self, path, sport, market):
+        self.path = path
+        self.sport = sport
+        self.market = market
+        self.rows_path = os.path.join(path, "rows.bin")
+        self.snapshots_path = os.path.join(path, "snapshots.bin")
+        self.strings_path = os.path.join(path, "strings.jsonl")
+        self.lock_path = os.path.join(path, "lock")
+
+        self.strings = []
+        self.string_ids = {}
+        self.strings_offset = 0
+        self.strings_lock = threading.RLock()
+
+    # workers append to the same board, so appends hold an exclusive file lock
+    @contextmanager
+    def locked(self):
+        os.makedirs(self.path, exist_ok=True)
+        with open(self.lock_path, "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # pick up strings other workers added since the last read
+    def load_strings(self):
+        with self.strings_lock:
+            if not os.path.exists(self.strings_path):
+                return
+            with open(self.strings_path, "rb") as f:
+                f.seek(self.strings_offset)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    value = json.loads(line)
+                    self.string_ids.setdefault(value, len(self.strings))
+                    self.strings.append(value)
+                    self.strings_offset += len(line)
+
+    def string_id(self, value, strings_file):
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            line = (json.dumps(value) + "\n").encode()
+            strings_file.write(line)
+            self.strings_offset += len(line)
+            string_id = self.string_ids[value] = len(self.strings)
+            self.strings.append(value)
+        return string_id
+
+    def append(self, snapshot):
+        with self.locked(), self.strings_lock:
+            self.load_strings()
+            rows = []
+            with open(self.strings_path, "ab") as strings_file:
+                sid = lambda value: self.string_id(value, strings_file)
+                for game in snapshot.games:
+                    game_ids = (sid(game.game_id), sid(game.home_team), sid(game.away_team), sid(game.commence_time))
+                    if not game.lines:
+                        rows.append(game_ids + (NO_LINE, 0, 0, 0, 0, (np.nan, np.nan), (np.nan, np.nan)))
+                    for line in game.lines.values():
+                        line_id = sid(line.key)
+                        for quote in line.quotes:
+                            points = quote.points if quote.points is not None else (None, None)
+                            rows.append(game_ids + (
+                                line_id, sid(quote.bookmaker), sid(quote.last_update), sid(quote.game_link), sid(quote.game_sid),
+                                quote.prices, tuple(np.nan if point is None else point for point in points),
+                            ))
+                remaining, bookmakers = sid(snapshot.remaining_requests), sid(json.dumps(snapshot.bookmakers))
+
+            start = os.path.getsize(self.rows_path) // ROW_DTYPE.itemsize if os.path.exists(self.rows_path) else 0
+            record = (to_epoch(snapshot.timestamp), start, len(rows), remaining, bookmakers)
+            with open(self.rows_path, "ab") as rows_file:
+                rows_file.write(np.array(rows, dtype=ROW_DTYPE).tobytes())
+            with open(self.snapshots_path, "ab") as snapshots_file:
+                snapshots_file.write(np.array([record], dtype=SNAPSHOT_DTYPE).tobytes())
+
+    # snapshot records fetched in [start, end) (ISO timestamps, either open), found by binary search
+    def records(self, start=None, end=None):
+        records = read_array(self.snapshots_path, SNAPSHOT_DTYPE)
+        lo = np.searchsorted(records["fetched"], to_epoch(start), "left") if start else 0
+        hi = np.searchsorted(records["fetched"], to_epoch(end), "left") if end else len(records)
+        return records[lo:hi]
+
+    def snapshot(self, record, rows):
+        strings = self.strings
+        snapshot = Snapshot(self.sport, self.market, json.loads(strings[record["bookmakers"]]),
+                            strings[record["remaining"]], [], from_epoch(record["fetched"].item()))
+
+        block = rows[record["start"]:record["start"] + record["count"]]
+        columns = [block[name].tolist() for name in ("game", "home", "away", "commence", "line", "bookmaker", "last_update", "link", "sid")]
+        game = None
+        for game_id, home, away, commence, line_id, bookmaker, last_update, link, sid, prices, points in zip(
+                *columns, block["price"].tolist(), block["point"].tolist()):
+            if game is None or game.game_id != strings[game_id]:
+                game = Game(strings[game_id], strings[home], strings[away], strings[commence])
+                snapshot.games.append(game)
+            if line_id == NO_LINE:
+                continue
+
+            key = strings[line_id]
+            line = game.lines.get(key)
+            if line is None:
+                line = game.lines[key] = Line(key)
+            if self.market == "h2h":
+                points = None
+            else:
+                points = tuple(None if math.isnan(point) else point for point in points)
+            line.quotes.append(BookQuote(strings[bookmaker], strings[last_update], strings[link], strings[sid], tuple(prices), points))
+        return snapshot
+
+    # Snapshots fetched in [start, end), oldest first, decoded one at a time off the memory map
+    def snapshots(self, start=None, end=None, limit=None):
+        records = self.records(start, end)
+        if limit is not None:
+            records = records[:limit]
+        rows = read_array(self.rows_path, ROW_DTYPE)
+        self.load_strings()
+        for record in records:
+            yield self.snapshot(record, rows)
+
+    # arb_pairs re-run over the first limit snapshots in range
+    def replay(self, start=None, end=None, limit=None, total_stake: float = 1000):
+        for snapshot in self.snapshots(start, end, limit):
+            yield snapshot, snapshot.arb_pairs(total_stake)
+
+    # backtest summary of the arbs in the first limit snapshots in range: how often they showed up,
+    # how long each lasted and which bookmaker pairs produced them. next_start is where the rest
+    # of the range picks up, None if it was all replayed
+    def arb_summary(self, start=None, end=None, kind="arb_pairs", limit=HISTORY_REPLAY_LIMIT):
+        records = self.records(start, end)
+        next_start = from_epoch(records[limit]["fetched"].item()) if len(records) > limit else None
+        snapshots = 0
+        with_arbs = 0
+        opportunities = {}
+        bookmaker_pairs = {}
+
+        for snapshot, pairs in self.replay(start, end, limit):
+            snapshots += 1
+            if pairs[kind]:
+                with_arbs += 1
+            for entry in pairs[kind]:
+                books = (entry["outcome_a_details"]["bookmaker"], entry["outcome_b_details"]["bookmaker"])
+                key = (entry["game_id"], entry.get("point"), books)
+                arb = float(entry["arbitrage"]["arb"].rstrip('%'))
+                opportunity = opportunities.get(key)
+                if opportunity is None:
+                    opportunity = opportunities[key] = {
+                        "game_id": entry["game_id"],
+                        "home_team": entry["home_team"],
+                        "away_team": entry["away_team"],
+                        "point": entry.get("point"),
+                        "bookmakers": list(books),
+                        "first_seen": snapshot.timestamp,
+                        "snapshots": 0,
+                        "best_arb": arb,
+                    }
+                    pair = "/".join(books)
+                    bookmaker_pairs[pair] = bookmaker_pairs.get(pair, 0) + 1
+                opportunity["last_seen"] = snapshot.timestamp
+                opportunity["snapshots"] += 1
+                opportunity["best_arb"] = max(opportunity["best_arb"], arb)
+
+        for opportunity in opportunities.values():
+            opportunity["seconds_open"] = to_epoch(opportunity["last_seen"]) - to_epoch(opportunity["first_seen"])
+
+        return {
+            "sport": self.sport,
+            "market": self.market,
+            "snapshots": snapshots,
+            "snapshots_with_arbs": with_arbs,
+            "opportunities": sorted(opportunities.values(), key=lambda opportunity: opportunity["first_seen"]),
+            "bookmaker_pairs": dict(sorted(bookmaker_pairs.items(), key=lambda item: -item[1])),
+            "next_start": next_start,
+        }
+
+
+# a directory of BoardHistory, one per sport/market
+class HistoryStore:
+    def __init__(self, root):
+        self.root = root
+        self.boards = {}
+        self.lock = threading.Lock()
+
+    def board(self, sport, market):
+        if not BOARD_NAME.fullmatch(sport) or not BOARD_NAME.fullmatch(market):
+            raise ValueError(f"Invalid board {sport}/{market}")
+        with self.lock:
+            board = self.boards.get((sport, market))
+            if board is None:
+                board = self.boards[(sport, market)] = BoardHistory(os.path.join(self.root, f"{sport}_{market}"), sport, market)
+        return board
+
+    def append(self, snapshot):
+        self.board(snapshot.sport, snapshot.market).append(snapshot)
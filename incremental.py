@@ -0,0 +1,128 @@
+import threading
+
+ARB_KINDS = ("arb_pairs", "low_hold_pairs", "low_vig_pairs")
+
+
+# what a line looked like in the last snapshot: the quotes it was computed from, the winning
+# quote indices and the arb entry (if any) it produced
+class LineState:
+    __slots__ = ("signature", "best", "kind", "entry")
+
+    def __init__(self, signature, best, kind, entry):
+        self.signature = signature
+        self.best = best
+        self.kind = kind
+        self.entry = entry
+
+
+# quotes a line's best/arb result depends on - (bookmaker, last_update) per quote in feed order
+def line_signature(game, line):
+    return (game.commence_time, tuple((quote.bookmaker, quote.last_update) for quote in line.quotes))
+
+
+# a line's state computed from scratch - freshly parsed lines already carry their running best
+def line_state(snapshot, game, line, total_stake):
+    if line.best is None:
+        line.find_best()
+    best = tuple(line.quotes.index(quote) if quote is not None else None for quote in line.best)
+    kind, entry = snapshot.arb_entry(game, line, total_stake)
+    return LineState(line_signature(game, line), best, kind, entry)
+
+
+# keeps each board's previous per-line results and only recomputes lines whose bookmakers changed.
+# Refreshes move between workers, so a board's state is only reused when it was computed from the
+# snapshot the refresh replaces - otherwise it's rebuilt from that snapshot first
+class ArbTracker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        # (sport, market) -> (timestamp of the snapshot the states came from, line id -> LineState)
+        self.boards = {}
+
+    # per-line states of the snapshot a refresh replaces, empty if there was none
+    def states(self, previous, total_stake):
+        if previous is None:
+            return {}
+        with self.lock:
+            timestamp, states = self.boards.get((previous.sport, previous.market), (None, None))
+        if states is not None and timestamp == previous.timestamp:
+            return states
+        return {(game.game_id, line.key): line_state(previous, game, line, total_stake) for game, line in previous.board_lines()}
+
+    # arb_pairs for the snapshot plus the delta (opened/changed/closed entries) against previous,
+    # the snapshot it replaces in the cache
+    def update(self, snapshot, previous=None, total_stake: float = 1000):
+        previous = self.states(previous, total_stake)
+
+        current = {}
+        pairs = {kind: [] for kind in ARB_KINDS}
+        recomputed = 0
+
+        for game, line in snapshot.board_lines():
+            line_id = (game.game_id, line.key)
+            signature = line_signature(game, line)
+            state = previous.get(line_id)
+
+            if state is not None and state.signature == signature:
+                # unchanged quotes - reuse the winners by position (when they were kept) and the previous entry
+                if state.best is not None:
+                    line.best = tuple(line.quotes[i] if i is not None else None for i in state.best)
+            else:
+                state = line_state(snapshot, game, line, total_stake)
+                recomputed += 1
+
+            current[line_id] = state
+            if state.kind:
+                pairs[state.kind].append(state.entry)
+
+        pairs["metadata"] = snapshot.metadata()
+        return pairs, self.commit(snapshot, previous, current, recomputed)
+
+    # the delta for arb_pairs computed elsewhere (the compute pool) against previous - entries are
+    # matched to their lines by game and point, and no winning quotes are kept, so the next update
+    # reuses the entries of unchanged lines but leaves their best to be found again
+    def record(self, snapshot, previous, pairs, total_stake: float = 1000):
+        previous = self.states(previous, total_stake)
+
+        entries = {}
+        for kind in ARB_KINDS:
+            for entry in pairs[kind]:
+                entries[(entry["game_id"], entry.get("point", "default"))] = (kind, entry)
+
+        current = {}
+        for game, line in snapshot.board_lines():
+            line_id = (game.game_id, line.key)
+            current[line_id] = LineState(line_signature(game, line), None, *entries.get(line_id, (None, None)))
+
+        return self.commit(snapshot, previous, current, len(current))
+
+    # keep a board's line states for its next refresh and diff them against the previous ones
+    def commit(self, snapshot, previous, current, recomputed):
+        with self.lock:
+            self.boards[(snapshot.sport, snapshot.market)] = (snapshot.timestamp, current)
+
+        delta = {
+            "sport": snapshot.sport,
+            "market": snapshot.market,
+            "timestamp": snapshot.timestamp,
+            "lines": len(current),
+            "recomputed": recomputed,
+            "opened": [],
+            "changed": [],
+            "closed": [],
+        }
+        for line_id, state in current.items():
+            old = previous.get(line_id)
+            old_kind = old.kind if old else None
+            if state.kind and state.kind == old_kind:
+                if state.entry is not old.entry and state.entry != old.entry:
+                    delta["changed"].append({"kind": state.kind, **state.entry})
+                continue
+            if old_kind:
+                delta["closed"].append({"kind": old_kind, **old.entry})
+            if state.kind:
+                delta["opened"].append({"kind": state.kind, **state.entry})
+        for line_id, old in previous.items():
+            if line_id not in current and old.kind:
+                delta["closed"].append({"kind": old.kind, **old.entry})
+
+        return delta
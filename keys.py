@@ -0,0 +1,117 @@
+import asyncio
+import time
+
+from constants import *
+from metrics import Gauge
+
+key_remaining = Gauge(
+    "arbapi_api_key_remaining",
+    "Requests left on each API key as last reported by x-requests-remaining",
+    ["key_index"],
+    )
+
+# picks the key (by index into ODDS_KEY_LIST) with the most requests left that isn't cooling down,
+# and reserves a lease's worth of its budget - one atomic step, so workers never collide or skip keys
+# KEYS[1] remaining-requests hash, KEYS[2] cooldown sorted set (score = cooldown end)
+# ARGV[1] now, ARGV[2] budget assumed for keys never seen, ARGV[3] requests reserved, ARGV[4] key count
+LEASE_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', ARGV[1])
+local best, best_remaining = nil, nil
+for index = 0, tonumber(ARGV[4]) - 1 do
+    if not redis.call('ZSCORE', KEYS[2], index) then
+        local remaining = tonumber(redis.call('HGET', KEYS[1], index) or ARGV[2])
+        if best == nil or remaining > best_remaining then
+            best, best_remaining = index, remaining
+        end
+    end
+end
+if best == nil then
+    return nil
+end
+redis.call('HSET', KEYS[1], best, best_remaining - tonumber(ARGV[3]))
+return best
+"""
+
+
+# hands out API keys from the pool by remaining quota: each worker leases a key for a few
+# requests/seconds so the hot path doesn't touch Redis, and upstream responses feed back each
+# key's x-requests-remaining - exhausted (429 or 0 left) and invalid (401) keys sit out a cooldown
+class KeyScheduler:
+    def __init__(self, redis_client, api_keys, remaining_key="api_key_remaining", cooldown_key="api_key_cooldown"):
+        self.redis_client = redis_client
+        self.api_keys = api_keys
+        self.remaining_key = remaining_key
+        self.cooldown_key = cooldown_key
+        self.lease_script = redis_client.register_script(LEASE_SCRIPT)
+
+        # held across the lease script call so concurrent requests share one lease
+        self.lock = asyncio.Lock()
+        # (key index, lease expiry, requests left on the lease)
+        self.lease = None
+        # (requests left across the pool, when to re-read it)
+        self.budget = None
+
+    # key for the next upstream request, None if every key is cooling down
+    async def current(self):
+        async with self.lock:
+            if self.lease is not None:
+                index, expires, uses = self.lease
+                if uses > 0 and time.monotonic() < expires:
+                    self.lease = (index, expires, uses - 1)
+                    return self.api_keys[index]
+
+            index = await self.lease_script(
+                keys=[self.remaining_key, self.cooldown_key],
+                args=[time.time(), KEY_DEFAULT_REMAINING, KEY_LEASE_REQUESTS, len(self.api_keys)],
+            )
+            if index is None:
+                self.lease = None
+                print("Error: No API keys available, all are cooling down")
+                return None
+
+            index = int(index)
+            self.lease = (index, time.monotonic() + KEY_LEASE_SECONDS, KEY_LEASE_REQUESTS - 1)
+            return self.api_keys[index]
+
+    # record the quota an upstream response reports for the key it was made with
+    async def record(self, api_key, response):
+        if api_key not in self.api_keys:
+            return
+        index = self.api_keys.index(api_key)
+
+        try:
+            remaining = int(float(response.headers.get('x-requests-remaining')))
+        except (TypeError, ValueError):
+            remaining = None
+        if remaining is not None:
+            await self.redis_client.hset(self.remaining_key, index, remaining)
+            key_remaining.set(remaining, key_index=index)
+
+        if response.status_code == 401:
+            print(f"Error: Invalid API key at index {index}, cooling down")
+            await self.cooldown(index, KEY_INVALID_COOLDOWN)
+        elif response.status_code == 429 or (remaining is not None and remaining <= 0):
+            print(f"API key at index {index} exhausted, cooling down")
+            await self.cooldown(index, KEY_EXHAUSTED_COOLDOWN)
+
+    # requests left across every key that isn't cooling down, keys not seen yet at KEY_DEFAULT_REMAINING
+    async def total_remaining(self):
+        if self.budget is not None and time.monotonic() < self.budget[1]:
+            return self.budget[0]
+
+        remaining = await self.redis_client.hgetall(self.remaining_key)
+        cooling = {int(index) for index in await self.redis_client.zrangebyscore(self.cooldown_key, time.time(), "+inf")}
+        total = 0
+        for index in range(len(self.api_keys)):
+            if index in cooling:
+                continue
+            total += max(int(float(remaining.get(str(index).encode(), KEY_DEFAULT_REMAINING))), 0)
+
+        self.budget = (total, time.monotonic() + KEY_BUDGET_CACHE_SECONDS)
+        return total
+
+    async def cooldown(self, index, seconds):
+        await self.redis_client.zadd(self.cooldown_key, {index: time.time() + seconds})
+        if self.lease is not None and self.lease[0] == index:
+            self.lease = None
+
@@ -0,0 +1,192 @@
+import contextlib
+import cProfile
+import functools
+import io
+import pstats
+import random
+import threading
+import time
+
+# Prometheus text-format metrics, kept per worker process
+registry = []
+
+# seconds - tuned for upstream/Redis calls
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# seconds - in-process stages can take well under a millisecond
+STAGE_BUCKETS = (0.0005, 0.001, 0.0025) + DEFAULT_BUCKETS
+
+
+def format_labels(labelnames, labelvalues, extra=()):
+    pairs = list(zip(labelnames, labelvalues)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        # label values -> running total
+        self.series = {}
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            self.series[key] = self.series.get(key, 0) + amount
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            series = dict(self.series)
+        for key, value in sorted(series.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+# current value per label set; with function, a single unlabelled value read at scrape time
+class Gauge:
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self.lock = threading.Lock()
+        self.series = {}
+        registry.append(self)
+
+    def set(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            self.series[key] = value
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        if self.function is not None:
+            lines.append(f"{self.name} {self.function()}")
+            return lines
+        with self.lock:
+            series = dict(self.series)
+        for key, value in sorted(series.items()):
+            lines.append(f"{self.name}{format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # label values -> [bucket counts..., count, sum]
+        self.series = {}
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {key: list(values) for key, values in self.series.items()}
+        for key, values in sorted(series.items()):
+            for bound, count in zip(self.buckets, values):
+                lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, [('le', bound)])} {count}")
+            lines.append(f"{self.name}_bucket{format_labels(self.labelnames, key, [('le', '+Inf')])} {values[-2]}")
+            lines.append(f"{self.name}_count{format_labels(self.labelnames, key)} {values[-2]}")
+            lines.append(f"{self.name}_sum{format_labels(self.labelnames, key)} {values[-1]}")
+        return lines
+
+
+stage_latency = Histogram(
+    "arbapi_stage_seconds",
+    "Time spent in each stage of serving odds (Redis reads/writes, decode, parse, best/arb, serialize)",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+    )
+
+
+# times the block into arbapi_stage_seconds
+@contextlib.contextmanager
+def span(stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        stage_latency.observe(time.perf_counter() - start, stage=stage)
+
+
+# a process runs one profiler at a time - a second enable() raises on 3.12+ and silently takes
+# over the first one's profile before that
+profiling = False
+profiling_lock = threading.Lock()
+
+
+# claims the process's profiler, False if another call holds it
+def start_profiling():
+    global profiling
+    with profiling_lock:
+        if profiling:
+            return False
+        profiling = True
+        return True
+
+
+def stop_profiling():
+    global profiling
+    with profiling_lock:
+        profiling = False
+
+
+# profiles a sample_rate fraction of calls to an async view and prints the hottest functions of
+# any that take longer than slow_seconds - the profile covers the whole event loop thread, so it
+# also picks up other requests' coroutines that ran while this one awaited Redis or upstream.
+# Calls sampled while another profile is running go unprofiled
+def profiled(sample_rate, slow_seconds):
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(*args, **kwargs):
+            if random.random() >= sample_rate or not start_profiling():
+                return await view(*args, **kwargs)
+
+            profiler = cProfile.Profile()
+            start = time.perf_counter()
+            try:
+                profiler.enable()
+            except ValueError:
+                # some other profiling tool is active
+                stop_profiling()
+                return await view(*args, **kwargs)
+            try:
+                return await view(*args, **kwargs)
+            finally:
+                profiler.disable()
+                stop_profiling()
+                elapsed = time.perf_counter() - start
+                if elapsed >= slow_seconds:
+                    output = io.StringIO()
+                    pstats.Stats(profiler, stream=output).sort_stats("cumulative").print_stats(25)
+                    print(f"Slow request {view.__name__}{kwargs} took {elapsed:.3f}s\n{output.getvalue()}")
+        return wrapper
+    return decorator
+
+
+# all registered metrics in the Prometheus text exposition format
+def render():
+    lines = []
+    for metric in registry:
+        lines += metric.collect()
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,341 @@
+import sys
+
+from odds import calculate_arb, format_arb_data, format_timestamp
+
+
+def intern(value):
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+# one bookmaker's two-way quote on a line; outcome a is home/Over, b is away/Under. bookmaker is
+# the feed's title and key its Odds API key (None where it wasn't kept, e.g. history). bet_limits
+# is the (a, b) max stake the feed reports, None for the bookmakers that don't report one
+class BookQuote:
+    __slots__ = ("bookmaker", "last_update", "game_link", "game_sid", "prices", "points", "bet_limits", "key")
+
+    def __init__(self, bookmaker, last_update, game_link, game_sid, prices, points=None, bet_limits=None, key=None):
+        self.bookmaker = intern(bookmaker)
+        self.key = intern(key)
+        self.last_update = intern(last_update)
+        self.game_link = game_link
+        self.game_sid = game_sid
+        self.prices = prices
+        self.points = points
+        self.bet_limits = bet_limits
+
+
+# every bookmaker's quote on one line of a game - "default" for h2h, the point for totals,
+# "home/away" points for spreads
+class Line:
+    __slots__ = ("key", "quotes", "best")
+
+    def __init__(self, key, quotes=None):
+        self.key = intern(key)
+        self.quotes = quotes if quotes is not None else []
+        # (outcome a, outcome b) winning quotes, filled in by Snapshot.best_lines
+        self.best = None
+
+    # first bookmaker with the highest price wins each outcome, same as the dict walk in odds.best_odds
+    def find_best(self):
+        best_a = best_b = None
+        for quote in self.quotes:
+            if best_a is None or quote.prices[0] > best_a.prices[0]:
+                best_a = quote
+            if best_b is None or quote.prices[1] > best_b.prices[1]:
+                best_b = quote
+        self.best = (best_a, best_b)
+        return self.best
+
+    # append a quote and keep the running best up to date - same winners as find_best; with
+    # keep=False only the best quotes are kept
+    def add(self, quote, keep=True):
+        if keep:
+            self.quotes.append(quote)
+        if self.best is None:
+            self.best = (quote, quote)
+            return
+        best_a, best_b = self.best
+        if quote.prices[0] > best_a.prices[0]:
+            best_a = quote
+        if quote.prices[1] > best_b.prices[1]:
+            best_b = quote
+        self.best = (best_a, best_b)
+
+
+class Game:
+    __slots__ = ("game_id", "home_team", "away_team", "commence_time", "lines")
+
+    def __init__(self, game_id, home_team, away_team, commence_time, lines=None):
+        self.game_id = game_id
+        self.home_team = intern(home_team)
+        self.away_team = intern(away_team)
+        self.commence_time = intern(commence_time)
+        self.lines = lines if lines is not None else {}
+
+
+# one market's normalized odds for a sport, as cached in process - the JSON shape get_odds
+# returns is only rebuilt at the edge (to_processed/to_json)
+class Snapshot:
+    __slots__ = ("sport", "market", "bookmakers", "remaining_requests", "games", "timestamp", "schedule")
+
+    def __init__(self, sport, market, bookmakers, remaining_requests, games, timestamp=None):
+        self.sport = sport
+        self.market = market
+        self.bookmakers = bookmakers
+        self.remaining_requests = remaining_requests
+        self.games = games
+        self.timestamp = timestamp
+        # schedule.Schedule this snapshot was cached with - its TTL and refresh state
+        self.schedule = None
+
+    def outcome_names(self, game):
+        if self.market == "totals":
+            return ("Over", "Under")
+        return (game.home_team, game.away_team)
+
+    @classmethod
+    def from_processed(cls, processed_odds: list, timestamp=None):
+        metadata = processed_odds[-1]
+        snapshot = cls(metadata["sport"], metadata["market"], metadata["bookmakers"],
+                       processed_odds[-2]["remaining_requests"], [], timestamp)
+
+        for game_data in processed_odds[:-2]:
+            game = Game(game_data["game_id"], game_data["home_team"], game_data["away_team"], game_data["commence_time"])
+            names = snapshot.outcome_names(game)
+
+            for key, bookmakers in game_data["bookmakers"].items():
+                line = Line(key)
+                for bookmaker in bookmakers:
+                    odds_a, odds_b = bookmaker["odds"][names[0]], bookmaker["odds"][names[1]]
+                    points = (odds_a[1], odds_b[1]) if len(odds_a) > 1 else None
+                    bet_limits = bookmaker.get("bet_limits")
+                    if bet_limits is not None:
+                        bet_limits = (bet_limits.get(names[0]), bet_limits.get(names[1]))
+                    line.quotes.append(BookQuote(
+                        bookmaker["name"], bookmaker["last_update"], bookmaker["game_link"], bookmaker["game_sid"],
+                        (odds_a[0], odds_b[0]), points, bet_limits, bookmaker.get("key"),
+                    ))
+                game.lines[line.key] = line
+
+            snapshot.games.append(game)
+
+        return snapshot
+
+    # same list get_odds returns
+    def to_processed(self) -> list:
+        processed_odds = []
+        for game in self.games:
+            names = self.outcome_names(game)
+            bookmakers = {}
+            for key, line in game.lines.items():
+                bookmakers[key] = []
+                for quote in line.quotes:
+                    if quote.points is None:
+                        odds = {names[0]: [quote.prices[0]], names[1]: [quote.prices[1]]}
+                    else:
+                        odds = {names[0]: [quote.prices[0], quote.points[0]], names[1]: [quote.prices[1], quote.points[1]]}
+                    bookmaker = {
+                        "name": quote.bookmaker,
+                        "key": quote.key,
+                        "market": self.market,
+                        "last_update": quote.last_update,
+                        "game_link": quote.game_link,
+                        "game_sid": quote.game_sid,
+                        "odds": odds
+                    }
+                    if quote.bet_limits is not None:
+                        bookmaker["bet_limits"] = {name: limit for name, limit in zip(names, quote.bet_limits) if limit is not None}
+                    bookmakers[key].append(bookmaker)
+            processed_odds.append({
+                "game_id": game.game_id,
+                "home_team": game.home_team,
+                "away_team": game.away_team,
+                "commence_time": game.commence_time,
+                "bookmakers": bookmakers
+            })
+
+        processed_odds.append({"remaining_requests": self.remaining_requests})
+        processed_odds.append({"sport": self.sport, "market": self.market, "bookmakers": self.bookmakers})
+        return processed_odds
+
+    # /odds/raw payload
+    def to_json(self) -> dict:
+        return {"data": self.to_processed(), "timestamp": self.timestamp}
+
+    # (game, line) pairs in board order
+    def board_lines(self):
+        for game in self.games:
+            if self.market == "h2h" and "default" not in game.lines:
+                # h2h games always get a (possibly empty) best entry
+                yield game, Line("default")
+                continue
+            for line in game.lines.values():
+                if self.market == "h2h" and line.key != "default":
+                    continue
+                yield game, line
+
+    # board_lines with each line's winning quotes found once
+    def best_lines(self):
+        for game, line in self.board_lines():
+            if line.best is None:
+                line.find_best()
+            yield game, line
+
+    # best outcome dict as best_odds shapes it, built from the winning quote
+    def best_outcome(self, game, line, outcome):
+        quote = line.best[outcome] if line.best else None
+        if quote is None:
+            best = {"name": None, "odds": None, "bookmaker": None, "last_update": None, "game_link": None, "game_sid": None}
+            if self.market == "totals":
+                best = {"name": None, "odds": None, "point": None, "bookmaker": None, "last_update": None, "game_link": None, "game_sid": None}
+            return best
+
+        best = {"name": self.outcome_names(game)[outcome], "odds": quote.prices[outcome]}
+        if self.market != "h2h":
+            best["point"] = line.key
+        best.update({
+            "bookmaker": quote.bookmaker,
+            "bookmaker_key": quote.key,
+            "last_update": quote.last_update,
+            "game_link": quote.game_link,
+            "game_sid": quote.game_sid
+        })
+        if quote.bet_limits is not None and quote.bet_limits[outcome] is not None:
+            best["bet_limit"] = quote.bet_limits[outcome]
+        return best
+
+    def best_line(self, game, line):
+        return {"outcome_a": self.best_outcome(game, line, 0), "outcome_b": self.best_outcome(game, line, 1)}
+
+    # same output as odds.best_odds(self.to_processed())
+    def best_odds(self) -> list:
+        best_odds = []
+        by_game = {}
+        for game, line in self.best_lines():
+            by_game.setdefault(id(game), []).append(line)
+
+        for game in self.games:
+            game_best_odds = {
+                "game_id": game.game_id,
+                "sport": self.sport,
+                "home_team": game.home_team,
+                "away_team": game.away_team,
+                "commence_time": game.commence_time,
+                "market": self.market,
+                "best_odds": {}
+            }
+            lines = by_game.get(id(game), [])
+            if self.market == "h2h":
+                game_best_odds["best_odds"] = self.best_line(game, lines[0])
+            else:
+                for line in lines:
+                    game_best_odds["best_odds"][line.key] = self.best_line(game, line)
+
+            if game_best_odds["best_odds"]:
+                best_odds.append(game_best_odds)
+
+        best_odds += self.metadata()
+        return best_odds
+
+    # arb_pairs list a line's best quotes belong in and its formatted entry, (None, None) if neither
+    def arb_entry(self, game, line, total_stake: float = 1000):
+        if line.best is None or line.best[0] is None or line.best[1] is None:
+            return None, None
+        best = {"outcome_a": {"odds": line.best[0].prices[0]}, "outcome_b": {"odds": line.best[1].prices[1]}}
+        arb_value, arb_data = calculate_arb(best, total_stake)
+        if arb_value < 1:
+            kind = "arb_pairs"
+        elif arb_value == 1:
+            kind = "low_hold_pairs"
+        elif 1 < arb_value < 1.01:
+            kind = "low_vig_pairs"
+        else:
+            return None, None
+        point = line.key if self.market != "h2h" else None
+        return kind, format_arb_data(game.game_id, self.sport, self.market, game.home_team, game.away_team,
+                                     game.commence_time, arb_data, self.best_line(game, line), point)
+
+    def metadata(self):
+        return [[{"remaining_requests": self.remaining_requests},
+                 {"sport": self.sport, "market": self.market, "bookmakers": self.bookmakers}]]
+
+    # same output as odds.arb_pairs(odds.best_odds(self.to_processed()))
+    def arb_pairs(self, total_stake: float = 1000) -> dict:
+        pairs = {"arb_pairs": [], "low_hold_pairs": [], "low_vig_pairs": []}
+
+        for game, line in self.best_lines():
+            kind, entry = self.arb_entry(game, line, total_stake)
+            if kind:
+                pairs[kind].append(entry)
+
+        pairs["metadata"] = self.metadata()
+        return pairs
+
+
+# upstream response -> {market: Snapshot} in one pass, the fused counterpart of odds.format_odds:
+# quotes go straight into Lines with the running best tracked as they arrive. best_only keeps just
+# the winning quotes - enough for best/arb output but not for to_processed or caching
+def parse_snapshots(raw_data: list, sport: str, markets: list, bookmakers: list, remaining_requests, best_only=False) -> dict:
+    snapshots = {market: Snapshot(sport, market, bookmakers, remaining_requests, []) for market in markets}
+    keep = not best_only
+
+    for game_data in raw_data:
+        home_team, away_team = game_data["home_team"], game_data["away_team"]
+        commence_time = format_timestamp(game_data["commence_time"])
+        games = {}
+        for market in markets:
+            games[market] = Game(game_data["id"], home_team, away_team, commence_time)
+
+        for bookmaker in game_data["bookmakers"]:
+            last_update = format_timestamp(bookmaker["last_update"])
+
+            for market_data in bookmaker["markets"]:
+                market = market_data["key"]
+                if market not in games:
+                    continue
+
+                # same outcome matching as odds.add_market_odds - later outcomes win, the
+                # totals line is keyed by the last outcome's point
+                home = away = None
+                home_limit = away_limit = None
+                point = None
+                for outcome in market_data["outcomes"]:
+                    point = outcome.get("point")
+                    if point is not None:
+                        point = float(point)
+                    name = outcome["name"]
+                    if market == "totals":
+                        if name == "Over":
+                            home, home_limit = (outcome["price"], point), outcome.get("bet_limit")
+                        elif name == "Under":
+                            away, away_limit = (outcome["price"], point), outcome.get("bet_limit")
+                    elif name == home_team:
+                        home, home_limit = (outcome["price"], point), outcome.get("bet_limit")
+                    elif name == away_team:
+                        away, away_limit = (outcome["price"], point), outcome.get("bet_limit")
+
+                if home is None or away is None:
+                    continue
+
+                if market == "totals":
+                    key = str(point)
+                elif market == "spreads":
+                    key = f"{home[1]}/{away[1]}"
+                else:
+                    key = "default"
+
+                lines = games[market].lines
+                line = lines.get(key)
+                if line is None:
+                    line = lines[key] = Line(key)
+                line.add(BookQuote(
+                    bookmaker["title"], last_update, bookmaker["link"], bookmaker["sid"],
+                    (home[0], away[0]), (home[1], away[1]) if market != "h2h" else None,
+                    (home_limit, away_limit) if home_limit is not None or away_limit is not None else None,
+                    bookmaker["key"],
+                ), keep)
+
+        for market in markets:
+            snapshots[market].games.append(games[market])
+
+    return snapshots
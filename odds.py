@@ -1,128 +1,76 @@
-import requests
+import functools
 import json
-from datetime import datetime
+import time
+from datetime import datetime, timezone
+
+import httpx
+import orjson
+
+import upstream
+from metrics import stage_latency
+from constants import *
+
+# The service parses upstream responses straight into Snapshots (models.parse_snapshots) and computes
+# best/arb from those. The dict walk here - get_odds/get_odds_multi -> format_odds -> best_odds ->
+# arb_pairs - has no production caller: it is kept as the reference implementation the tests and
+# benchmarks check the Snapshot and NumPy engines against. fetch_odds and the helpers below
+# (calculate_arb, format_arb_data, ...) are shared with the service
+
+async def get_odds(sport: str, api_key: str, market: str, bookmakers: list, keys=None) -> list:
+    # only 1 market at a time - guarantees request size
+    odds = await get_odds_multi(sport, api_key, [market], bookmakers, keys)
+    if odds is None:
+        return None
+    return odds[market]
+
+
+# fetch several markets in one request and split the response into per-market lists
+# (same shape get_odds returns for a single market); keys (a KeyScheduler) records quota and swaps keys on 401/429
+async def get_odds_multi(sport: str, api_key: str, markets: list, bookmakers: list, keys=None) -> dict:
+    return await fetch_odds(sport, api_key, markets, bookmakers, keys, format_odds)
+
 
-def get_odds(sport: str, api_key: str, market: str, bookmakers: list) -> list:
-    
-    url = f"https://api.the-odds-api.com/v4/sports/{sport}/odds"
+# request markets from The Odds API and return parse(raw_data, sport, markets, bookmakers, remaining_requests),
+# None if the request or the parse fails; commence_to (epoch seconds) leaves out games starting later
+async def fetch_odds(sport: str, api_key: str, markets: list, bookmakers: list, keys, parse, commence_to=None):
+
+    url = f"{ODDS_API_BASE_URL}/v4/sports/{sport}/odds"
     params = {
         "apiKey": api_key,
-        "markets": market, # only 1 market at a time - guarantees request size
+        "markets": ",".join(markets),
         "bookmakers": ",".join(bookmakers),
         "oddsFormat": "decimal",
         "includeLinks": 'true',
         "includeSids": 'true',
         "includeBetLimits": 'true',
     }
+    if commence_to is not None:
+        params["commenceTimeTo"] = datetime.fromtimestamp(commence_to, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
 
     try:
-        response = requests.get(url, params=params)
+        response = await upstream.get(url, params, keys)
         response.raise_for_status()
 
-        raw_data = response.json()
-        formatted_data = []
-
-        for game in raw_data:
-            game_data = {
-                "game_id": game["id"],
-                "home_team": game["home_team"],
-                "away_team": game["away_team"],
-                "commence_time": datetime.fromisoformat(game["commence_time"].replace("Z", "+00:00")).strftime("%Y-%m-%d %H:%M:%S"),
-                "bookmakers": {}
-            }
-
-            for bookmaker in game["bookmakers"]:
-                bookmaker_data = {
-                    "name": bookmaker["title"],
-                    "market": market,
-                    "last_update": datetime.fromisoformat(bookmaker["last_update"].replace("Z", "+00:00")).strftime("%Y-%m-%d %H:%M:%S"),
-                    "game_link": bookmaker["link"],
-                    "game_sid": bookmaker["sid"],
-                    "odds": {}
-                }
-
-                if bookmaker["markets"]:
-                    # Initialize a temporary dictionary to store outcomes
-                    temp_odds = {}
-
-                    for outcome in bookmaker["markets"][0]["outcomes"]:
-                        point = outcome.get("point")
-                        if point is not None:
-                            point = float(point)
-                        odds = outcome["price"]
-
-                        if market == "totals":
-                            # Store outcomes in temp_odds to ensure they are added once
-                            if outcome["name"] == "Over":
-                                temp_odds["home"] = (outcome["name"], [odds, point])
-                            elif outcome["name"] == "Under":
-                                temp_odds["away"] = (outcome["name"], [odds, point])
-
-                        elif market == "spreads":
-                            # Handle spreads, considering potential flips
-                            if outcome["name"] == game["home_team"]:
-                                home_point = point
-                                away_point = -point
-                                temp_odds["home"] = (outcome["name"], [odds, point])
-                            elif outcome["name"] == game["away_team"]:
-                                away_point = point
-                                home_point = -point
-                                temp_odds["away"] = (outcome["name"], [odds, point])
-
-                        elif market == "h2h":
-                            # Directly add h2h odds, ensuring home team is first
-                            if outcome["name"] == game["home_team"]:
-                                temp_odds["home"] = (outcome["name"], [odds])
-                            elif outcome["name"] == game["away_team"]:
-                                temp_odds["away"] = (outcome["name"], [odds])
-
-                    # Add bookmaker data for totals
-                    if market == "totals" and "home" in temp_odds and "away" in temp_odds:
-                        if point not in game_data["bookmakers"]:
-                            game_data["bookmakers"][point] = []
-                        bookmaker_data["odds"][temp_odds["home"][0]] = temp_odds["home"][1]
-                        bookmaker_data["odds"][temp_odds["away"][0]] = temp_odds["away"][1]
-                        game_data["bookmakers"][point].append(bookmaker_data)
-
-                    # Ensure the home team comes first in the odds dictionary for spreads
-                    if market == "spreads" and "home" in temp_odds and "away" in temp_odds:
-                        bookmaker_data["odds"][temp_odds["home"][0]] = temp_odds["home"][1]
-                        bookmaker_data["odds"][temp_odds["away"][0]] = temp_odds["away"][1]
-
-                        # Use a string representation of the tuple to group spreads
-                        point_pair = f"{temp_odds['home'][1][1]}/{temp_odds['away'][1][1]}"
-                        if point_pair not in game_data["bookmakers"]:
-                            game_data["bookmakers"][point_pair] = []
-                        game_data["bookmakers"][point_pair].append(bookmaker_data)
-
-                    # Add bookmaker data for h2h
-                    if market == "h2h" and "home" in temp_odds and "away" in temp_odds:
-                        bookmaker_data["odds"][temp_odds["home"][0]] = temp_odds["home"][1]
-                        bookmaker_data["odds"][temp_odds["away"][0]] = temp_odds["away"][1]
-                        if "default" not in game_data["bookmakers"]:
-                            game_data["bookmakers"]["default"] = []
-                        game_data["bookmakers"]["default"].append(bookmaker_data)
-
-            formatted_data.append(game_data)
-
+        parse_start = time.perf_counter()
+        raw_data = orjson.loads(response.content)
         remaining_requests = response.headers.get('x-requests-remaining', 'Unknown')
-        formatted_data.append({"remaining_requests": remaining_requests})
-        formatted_data.append({"sport": sport, "market": market, "bookmakers": bookmakers})
- 
-        return formatted_data
+        parsed = parse(raw_data, sport, markets, bookmakers, remaining_requests)
 
-    except requests.exceptions.RequestException as e:
-        if isinstance(e, requests.exceptions.HTTPError):
+        stage_latency.observe(time.perf_counter() - parse_start, stage="parse")
+        return parsed
+
+    except httpx.HTTPError as e:
+        if isinstance(e, httpx.HTTPStatusError):
             if e.response.status_code == 401:
                 print("Error: Invalid API key")
             elif e.response.status_code == 429:
                 print("Error: API request limit exceeded")
             else:
                 print(f"HTTP Error: {e}")
-        elif isinstance(e, requests.exceptions.ConnectionError):
-            print("Error: Unable to connect to the API")
-        elif isinstance(e, requests.exceptions.Timeout):
+        elif isinstance(e, httpx.TimeoutException):
             print("Error: API request timed out")
+        elif isinstance(e, httpx.NetworkError):
+            print("Error: Unable to connect to the API")
         else:
             print(f"An unexpected error occurred: {e}")
         return None
@@ -137,6 +85,136 @@ def get_odds(sport: str, api_key: str, market: str, bookmakers: list) -> list:
         return None
 
 
+# upstream response -> per-market lists of game dicts with every bookmaker's quote grouped by line
+def format_odds(raw_data: list, sport: str, markets: list, bookmakers: list, remaining_requests) -> dict:
+    formatted_data = {market: [] for market in markets}
+
+    for game in raw_data:
+        games_data = {}
+        for market in markets:
+            games_data[market] = {
+                "game_id": game["id"],
+                "home_team": game["home_team"],
+                "away_team": game["away_team"],
+                "commence_time": format_timestamp(game["commence_time"]),
+                "bookmakers": {}
+            }
+
+        for bookmaker in game["bookmakers"]:
+            last_update = format_timestamp(bookmaker["last_update"])
+
+            # single pass over every market this bookmaker quoted
+            for market_data in bookmaker["markets"]:
+                market = market_data["key"]
+                if market not in games_data:
+                    continue
+                bookmaker_data = {
+                    "name": bookmaker["title"],
+                    "key": bookmaker["key"],
+                    "market": market,
+                    "last_update": last_update,
+                    "game_link": bookmaker["link"],
+                    "game_sid": bookmaker["sid"],
+                    "odds": {}
+                }
+                add_market_odds(games_data[market], game, bookmaker_data, market, market_data["outcomes"])
+
+        for market in markets:
+            formatted_data[market].append(games_data[market])
+
+    for market in markets:
+        formatted_data[market].append({"remaining_requests": remaining_requests})
+        formatted_data[market].append({"sport": sport, "market": market, "bookmakers": bookmakers})
+
+    return formatted_data
+
+
+# upstream ISO timestamp -> "%Y-%m-%d %H:%M:%S"; memoized since a board repeats the same few
+# commence/last_update values across every game and bookmaker
+@functools.lru_cache(maxsize=4096)
+def format_timestamp(value: str) -> str:
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).strftime("%Y-%m-%d %H:%M:%S")
+
+
+# format_timestamp's "%Y-%m-%d %H:%M:%S" (UTC) -> epoch seconds
+@functools.lru_cache(maxsize=4096)
+def commence_epoch(value: str) -> float:
+    return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+
+
+# group one bookmaker's outcomes for a market under the game's line key
+def add_market_odds(game_data: dict, game: dict, bookmaker_data: dict, market: str, outcomes: list):
+    # Initialize a temporary dictionary to store outcomes
+    temp_odds = {}
+    # bet_limit per side, for the bookmakers that report one
+    temp_limits = {}
+
+    for outcome in outcomes:
+        point = outcome.get("point")
+        if point is not None:
+            point = float(point)
+        odds = outcome["price"]
+
+        if market == "totals":
+            # Store outcomes in temp_odds to ensure they are added once
+            if outcome["name"] == "Over":
+                temp_odds["home"] = (outcome["name"], [odds, point])
+                temp_limits["home"] = outcome.get("bet_limit")
+            elif outcome["name"] == "Under":
+                temp_odds["away"] = (outcome["name"], [odds, point])
+                temp_limits["away"] = outcome.get("bet_limit")
+
+        elif market == "spreads":
+            # Handle spreads, considering potential flips
+            if outcome["name"] == game["home_team"]:
+                temp_odds["home"] = (outcome["name"], [odds, point])
+                temp_limits["home"] = outcome.get("bet_limit")
+            elif outcome["name"] == game["away_team"]:
+                temp_odds["away"] = (outcome["name"], [odds, point])
+                temp_limits["away"] = outcome.get("bet_limit")
+
+        elif market == "h2h":
+            # Directly add h2h odds, ensuring home team is first
+            if outcome["name"] == game["home_team"]:
+                temp_odds["home"] = (outcome["name"], [odds])
+                temp_limits["home"] = outcome.get("bet_limit")
+            elif outcome["name"] == game["away_team"]:
+                temp_odds["away"] = (outcome["name"], [odds])
+                temp_limits["away"] = outcome.get("bet_limit")
+
+    if "home" not in temp_odds or "away" not in temp_odds:
+        return
+
+    bookmaker_data["odds"][temp_odds["home"][0]] = temp_odds["home"][1]
+    bookmaker_data["odds"][temp_odds["away"][0]] = temp_odds["away"][1]
+    bet_limits = {temp_odds[side][0]: temp_limits[side] for side in ("home", "away") if temp_limits.get(side) is not None}
+    if bet_limits:
+        bookmaker_data["bet_limits"] = bet_limits
+
+    # Add bookmaker data for totals, keyed by the point as a string (same key the cached JSON has)
+    if market == "totals":
+        line = str(point)
+    # Use a string representation of the tuple to group spreads, home team first
+    elif market == "spreads":
+        line = f"{temp_odds['home'][1][1]}/{temp_odds['away'][1][1]}"
+    # Add bookmaker data for h2h
+    else:
+        line = "default"
+
+    if line not in game_data["bookmakers"]:
+        game_data["bookmakers"][line] = []
+    game_data["bookmakers"][line].append(bookmaker_data)
+
+
+# the winning bookmaker's bet limit on a best outcome, dropped when the new winner doesn't report one
+def set_bet_limit(best: dict, bookmaker: dict, outcome_name: str):
+    limit = bookmaker.get("bet_limits", {}).get(outcome_name)
+    if limit is None:
+        best.pop("bet_limit", None)
+    else:
+        best["bet_limit"] = limit
+
+
 # find best odds for each market passed in
 def best_odds(processed_odds: list) -> list:
     # just the games, not the requests header
@@ -182,20 +260,24 @@ def best_odds(processed_odds: list) -> list:
                                 "name": outcome_name,
                                 "odds": outcome_details[0],
                                 "bookmaker": bookmaker["name"],
+                                "bookmaker_key": bookmaker.get("key"),
                                 "last_update": bookmaker["last_update"],
                                 "game_link": bookmaker["game_link"],
                                 "game_sid": bookmaker["game_sid"]
                             })
+                            set_bet_limit(best_h2h["outcome_a"], bookmaker, outcome_name)
                     elif outcome_name == game["away_team"]:
                         if best_h2h["outcome_b"]["odds"] is None or outcome_details[0] > best_h2h["outcome_b"]["odds"]:
                             best_h2h["outcome_b"].update({
                                 "name": outcome_name,
                                 "odds": outcome_details[0],
                                 "bookmaker": bookmaker["name"],
+                                "bookmaker_key": bookmaker.get("key"),
                                 "last_update": bookmaker["last_update"],
                                 "game_link": bookmaker["game_link"],
                                 "game_sid": bookmaker["game_sid"]
                             })
+                            set_bet_limit(best_h2h["outcome_b"], bookmaker, outcome_name)
             game_best_odds["best_odds"] = best_h2h
 
         elif market == "totals":
@@ -229,10 +311,12 @@ def best_odds(processed_odds: list) -> list:
                                     "odds": outcome_details[0],
                                     "point": point,
                                     "bookmaker": bookmaker["name"],
+                                    "bookmaker_key": bookmaker.get("key"),
                                     "last_update": bookmaker["last_update"],
                                     "game_link": bookmaker["game_link"],
                                     "game_sid": bookmaker["game_sid"]
                                 })
+                                set_bet_limit(best_totals["outcome_a"], bookmaker, outcome_name)
                         elif outcome_name == "Under":
                             if best_totals["outcome_b"]["odds"] is None or outcome_details[0] > best_totals["outcome_b"]["odds"]:
                                 best_totals["outcome_b"].update({
@@ -240,10 +324,12 @@ def best_odds(processed_odds: list) -> list:
                                     "odds": outcome_details[0],
                                     "point": point,
                                     "bookmaker": bookmaker["name"],
+                                    "bookmaker_key": bookmaker.get("key"),
                                     "last_update": bookmaker["last_update"],
                                     "game_link": bookmaker["game_link"],
                                     "game_sid": bookmaker["game_sid"]
                                 })
+                                set_bet_limit(best_totals["outcome_b"], bookmaker, outcome_name)
                 game_best_odds["best_odds"][point] = best_totals
 
         elif market == "spreads":
@@ -275,10 +361,12 @@ def best_odds(processed_odds: list) -> list:
                                     "odds": outcome_details[0],
                                     "point": point_pair,
                                     "bookmaker": bookmaker["name"],
+                                    "bookmaker_key": bookmaker.get("key"),
                                     "last_update": bookmaker["last_update"],
                                     "game_link": bookmaker["game_link"],
                                     "game_sid": bookmaker["game_sid"]
                                 })
+                                set_bet_limit(best_spreads["outcome_a"], bookmaker, outcome_name)
                         elif outcome_name == game["away_team"]:
                             if best_spreads["outcome_b"]["odds"] is None or outcome_details[0] > best_spreads["outcome_b"]["odds"]:
                                 best_spreads["outcome_b"].update({
@@ -286,10 +374,12 @@ def best_odds(processed_odds: list) -> list:
                                     "odds": outcome_details[0],
                                     "point": point_pair,
                                     "bookmaker": bookmaker["name"],
+                                    "bookmaker_key": bookmaker.get("key"),
                                     "last_update": bookmaker["last_update"],
                                     "game_link": bookmaker["game_link"],
                                     "game_sid": bookmaker["game_sid"]
                                 })
+                                set_bet_limit(best_spreads["outcome_b"], bookmaker, outcome_name)
                 game_best_odds["best_odds"][point_pair] = best_spreads
 
         if game_best_odds["best_odds"]:
@@ -400,6 +490,7 @@ def format_arb_data(game_id, sport, market, home_team, away_team, commence_time,
         "arbitrage": arb_data,
         "outcome_a_details": {
             "bookmaker": best_odds["outcome_a"]["bookmaker"],
+            "bookmaker_key": best_odds["outcome_a"].get("bookmaker_key"),
             "game_link": best_odds["outcome_a"]["game_link"],
             "game_sid": best_odds["outcome_a"]["game_sid"],
             "last_update": best_odds["outcome_a"]["last_update"],
@@ -407,12 +498,31 @@ def format_arb_data(game_id, sport, market, home_team, away_team, commence_time,
         },
         "outcome_b_details": {
             "bookmaker": best_odds["outcome_b"]["bookmaker"],
+            "bookmaker_key": best_odds["outcome_b"].get("bookmaker_key"),
             "game_link": best_odds["outcome_b"]["game_link"],
             "game_sid": best_odds["outcome_b"]["game_sid"],
             "last_update": best_odds["outcome_b"]["last_update"],
             "odds": best_odds["outcome_b"]["odds"]
         }
     }
+    for outcome in ("outcome_a", "outcome_b"):
+        if best_odds[outcome].get("bet_limit") is not None:
+            arb_info[f"{outcome}_details"]["bet_limit"] = best_odds[outcome]["bet_limit"]
     if point:
         arb_info["point"] = point
-    return arb_info
\ No newline at end of file
+    return arb_info
+
+# arb % of a formatted pair as a number, e.g. "1.25%" -> 1.25
+def arb_percent(arb_info):
+    return float(arb_info["arbitrage"]["arb"].rstrip('%'))
+
+
+# bookmaker title or key reduced to lowercase alphanumerics, so "ESPN BET" matches "espnbet"
+def normalize_bookmaker(bookmaker):
+    return "".join(ch for ch in bookmaker.lower() if ch.isalnum())
+
+
+# the bookmaker an arb leg is on, by its Odds API key (the names in BOOKMAKERS) - entries without
+# one, like those replayed from history, fall back to the title
+def leg_bookmaker(details):
+    return normalize_bookmaker(details.get("bookmaker_key") or details["bookmaker"])
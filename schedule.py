@@ -0,0 +1,130 @@
+import json
+import time
+
+from constants import *
+from metrics import Counter, Gauge
+from models import Snapshot
+from odds import commence_epoch
+
+board_ttl = Gauge(
+    "arbapi_board_ttl_seconds",
+    "TTL the scheduler picked for each board's last refresh",
+    ["sport", "market"],
+    )
+fetch_scope = Counter(
+    "arbapi_fetch_scope_total",
+    "Upstream fetches by scope: the full board, or only the games inside FETCH_WINDOW",
+    ["scope"],
+    )
+
+
+# how long a cached board stays fresh, the smoothed share of its lines that move between
+# refreshes, and when its games past FETCH_WINDOW were last fetched (epoch seconds) - cached in
+# Redis next to the board so every worker schedules it the same way
+class Schedule:
+    __slots__ = ("ttl", "volatility", "full_timestamp")
+
+    def __init__(self, ttl=CACHE_TTL, volatility=None, full_timestamp=None):
+        self.ttl = ttl
+        self.volatility = volatility
+        self.full_timestamp = full_timestamp
+
+    def encode(self):
+        return json.dumps({"ttl": self.ttl, "volatility": self.volatility, "full_timestamp": self.full_timestamp})
+
+    @classmethod
+    def decode(cls, value):
+        return cls(**json.loads(value))
+
+
+# epoch seconds the nearest game that hasn't started yet commences, None if there isn't one
+def next_commence(snapshot, now):
+    upcoming = [start for start in (commence_epoch(game.commence_time) for game in snapshot.games) if start > now]
+    return min(upcoming, default=None)
+
+
+# share of the fetched lines whose quotes differ from the previous snapshot's - new lines count as moved
+def changed_fraction(previous, fetched):
+    before = {(game.game_id, line.key): line for game, line in previous.board_lines()}
+    total = changed = 0
+    for game, line in fetched.board_lines():
+        total += 1
+        old = before.get((game.game_id, line.key))
+        if old is None or [(quote.bookmaker, quote.prices) for quote in old.quotes] != [(quote.bookmaker, quote.prices) for quote in line.quotes]:
+            changed += 1
+    return changed / total if total else 0.0
+
+
+# board of the games fetched inside the window plus the previous board's games past it
+def merge_window(fetched, previous, window_end):
+    later = [game for game in previous.games if commence_epoch(game.commence_time) > window_end]
+    return Snapshot(fetched.sport, fetched.market, fetched.bookmakers, fetched.remaining_requests, fetched.games + later)
+
+
+# picks each board's TTL on refresh: a base from how soon its next game starts (TTL_BY_COMMENCE),
+# shortened when many lines moved since the last refresh and stretched when few did, then
+# stretched again when the key pool runs low. Boards whose later games were fetched recently are
+# refreshed with commenceTimeTo, so the payload only carries the games inside FETCH_WINDOW
+class FetchScheduler:
+    def __init__(self, keys):
+        self.keys = keys
+
+    def commence_ttl(self, snapshot, now):
+        start = next_commence(snapshot, now)
+        if start is None:
+            return TTL_MAX
+        for within, ttl in TTL_BY_COMMENCE:
+            if start - now < within:
+                return ttl
+        return TTL_MAX
+
+    # stretch for a smoothed change rate below TTL_VOLATILITY_TARGET, shrink above it
+    def volatility_factor(self, volatility):
+        if volatility is None:
+            return 1.0
+        return min(max(TTL_VOLATILITY_TARGET / max(volatility, 1e-9), 1 / TTL_VOLATILITY_MAX_STRETCH), TTL_VOLATILITY_MAX_STRETCH)
+
+    # 1 while the pool has TTL_BUDGET_COMFORT requests left, up to TTL_BUDGET_MAX_STRETCH as it drains
+    async def budget_factor(self):
+        try:
+            remaining = await self.keys.total_remaining()
+        except Exception as e:
+            print(f"Failed to read the key budget: {e}")
+            return 1.0
+        return min(max(TTL_BUDGET_COMFORT / max(remaining, 1), 1.0), TTL_BUDGET_MAX_STRETCH)
+
+    # commenceTimeTo for a refresh of these markets (epoch seconds), None for a full fetch - only
+    # when every market has a cached board whose later games were fetched within FETCH_FULL_INTERVAL
+    def window_end(self, markets, stale):
+        if not (ADAPTIVE_TTL and FETCH_WINDOW_ENABLED):
+            return None
+        now = time.time()
+        for market in markets:
+            previous = stale.get(market)
+            schedule = previous.schedule if previous is not None else None
+            if schedule is None or schedule.full_timestamp is None or now - schedule.full_timestamp > FETCH_FULL_INTERVAL:
+                fetch_scope.inc(scope="full")
+                return None
+        fetch_scope.inc(scope="window")
+        return now + FETCH_WINDOW
+
+    # schedule for a freshly fetched board - fetched is what came back from upstream, snapshot the
+    # board as cached (fetched plus any games kept from previous past the window)
+    async def schedule(self, fetched, snapshot, previous, full):
+        now = time.time()
+        if not ADAPTIVE_TTL:
+            return Schedule(CACHE_TTL, None, now)
+
+        last = previous.schedule if previous is not None else None
+        volatility = None
+        if previous is not None:
+            volatility = changed_fraction(previous, fetched)
+            if last is not None and last.volatility is not None:
+                volatility = TTL_VOLATILITY_SMOOTHING * volatility + (1 - TTL_VOLATILITY_SMOOTHING) * last.volatility
+
+        ttl = self.commence_ttl(snapshot, now) * self.volatility_factor(volatility) * await self.budget_factor()
+        ttl = round(min(max(ttl, TTL_MIN), TTL_MAX))
+        board_ttl.set(ttl, sport=snapshot.sport, market=snapshot.market)
+
+        full_timestamp = now if full else last.full_timestamp
+        return Schedule(ttl, volatility, full_timestamp)
@@ -0,0 +1,523 @@
+import asyncio
+import contextlib
+import secrets
+import threading
+import time
+from datetime import timedelta, datetime
+
+from constants import *
+from odds import fetch_odds, arb_percent
+from cache import SingleFlight, RefreshAhead, LRUCache
+from models import Snapshot, parse_snapshots
+from incremental import ArbTracker
+from codec import encode, decode, CodecError
+from metrics import Counter, span
+from stream import ArbBroadcaster
+from history import HistoryStore
+from arbindex import ArbIndex
+from schedule import FetchScheduler, Schedule, merge_window
+from compute import ComputePool
+
+if ODDS_ENGINE == "numpy":
+    from engine import OddsBoard
+
+cache_lookups = Counter(
+    "arbapi_cache_lookups_total",
+    "Odds lookups per (sport, market): fresh hit, stale (refresh needed) or miss",
+    ["result"],
+    )
+cache_reads = Counter(
+    "arbapi_cache_reads_total",
+    "Cached odds read, by source: l1, l1 revalidated against Redis, or decoded from Redis",
+    ["source"],
+    )
+stale_served = Counter(
+    "arbapi_cache_stale_served_total",
+    "Expired odds served while a refresh was in flight elsewhere",
+    )
+
+# releases fetch locks only while they still hold this worker's token - a fetch that outlived
+# CACHE_LOCK_TTL must not delete a lock another worker has taken since
+# KEYS the lock keys, ARGV[1] the token they were set with
+RELEASE_SCRIPT = """
+local released = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('GET', key) == ARGV[1] then
+        released = released + redis.call('DEL', key)
+    end
+end
+return released
+"""
+
+
+# seconds a cached snapshot stays fresh - its scheduled TTL, CACHE_TTL if it has none
+def cache_ttl(snapshot):
+    return snapshot.schedule.ttl if snapshot.schedule is not None else CACHE_TTL
+
+
+# cached odds younger than their TTL, less ahead seconds
+def is_fresh(snapshot, ahead=0):
+    if not snapshot.timestamp:
+        return False
+    age = datetime.utcnow() - datetime.fromisoformat(snapshot.timestamp)
+    return age < timedelta(seconds=cache_ttl(snapshot) - ahead)
+
+
+# odds pipeline: Redis/L1 cache -> get_odds -> best_odds -> arb_pairs, passing Snapshots
+# between stages - the JSON shape is only built for the route's response
+class OddsService:
+    def __init__(self, redis_client, executor, keys):
+        self.redis_client = redis_client
+        self.executor = executor
+        self.keys = keys
+
+        # per-worker L1 in front of Redis: (sport, market) -> decoded Snapshot plus the best/arb results computed from it
+        self.l1_cache = LRUCache(L1_MAX_ENTRIES, L1_TTL)
+        self.flights = SingleFlight()
+        self.refresher = RefreshAhead(self.refresh_hot_odds, REFRESH_CHECK_INTERVAL, REFRESH_HOT_WINDOW)
+        self.tracker = ArbTracker()
+        self.broadcaster = ArbBroadcaster(redis_client)
+        self.history = HistoryStore(HISTORY_DIR) if HISTORY_ENABLED else None
+        self.arb_index = ArbIndex(redis_client) if ARB_INDEX_ENABLED else None
+        self.scheduler = FetchScheduler(keys)
+        self.compute = ComputePool() if COMPUTE_MODE == "process" else None
+        self.release_script = redis_client.register_script(RELEASE_SCRIPT)
+
+    # one market's Snapshot, None if it couldn't be fetched
+    async def snapshot(self, sport, market):
+        raw_data = await self.get_sport_odds(sport, [market])
+        return raw_data[market] if raw_data else None
+
+    async def raw(self, sport, market):
+        snapshot = await self.snapshot(sport, market)
+        if snapshot is None:
+            return None
+        return snapshot.to_json()
+
+    async def best(self, sport, market):
+        snapshot = await self.snapshot(sport, market)
+        if snapshot is None:
+            return None
+        return {"data": self.best_data(sport, market, snapshot), "timestamp": snapshot.timestamp}
+
+    async def arb(self, sport, market):
+        snapshot = await self.snapshot(sport, market)
+        if snapshot is None:
+            return None
+        return {"data": self.arb_data(sport, market, snapshot), "timestamp": snapshot.timestamp}
+
+    # every market's arbs for a sport from a single upstream request
+    async def arb_all(self, sport):
+        raw_data = await self.get_sport_odds(sport, MARKETS)
+        if raw_data is None:
+            return None
+
+        await self.precompute_arbs([(sport, market, raw_data[market]) for market in MARKETS])
+        arb_data = {}
+        for market in MARKETS:
+            arb_data[market] = {"data": self.arb_data(sport, market, raw_data[market]), "timestamp": raw_data[market].timestamp}
+        return arb_data
+
+    # arbs across many sports/markets, merged and sorted best first
+    async def scan(self, sports, markets):
+        # one MGET for every cache hit, then all sports with misses fetched concurrently
+        cached_odds = await self.get_cached_odds_many([(sport, market) for sport in sports for market in markets])
+        semaphore = asyncio.Semaphore(SCAN_CONCURRENCY)
+        results = await asyncio.gather(*[
+            self.get_sport_odds(sport, markets, cached_odds, semaphore, SCAN_TIMEOUT) for sport in sports
+        ])
+
+        await self.precompute_arbs([
+            (sport, market, raw_data[market]) for sport, raw_data in zip(sports, results) if raw_data is not None for market in markets
+        ])
+
+        pairs = {"arb_pairs": [], "low_hold_pairs": [], "low_vig_pairs": []}
+        timestamps = {}
+        failed = []
+        for sport, raw_data in zip(sports, results):
+            if raw_data is None:
+                failed.append(sport)
+                continue
+
+            timestamps[sport] = {}
+            for market in markets:
+                sport_pairs = self.arb_data(sport, market, raw_data[market])
+                for kind in pairs:
+                    pairs[kind] += sport_pairs[kind]
+                timestamps[sport][market] = raw_data[market].timestamp
+
+        # best arb first
+        for kind in pairs:
+            pairs[kind].sort(key=arb_percent, reverse=True)
+
+        return {"data": pairs, "timestamps": timestamps, "failed": failed}
+
+    def best_data(self, sport, market, snapshot):
+        if ODDS_ENGINE == "numpy":
+            return self.derived(sport, market, snapshot, "best", lambda snapshot: self.board(sport, market, snapshot).best_odds())
+        return self.derived(sport, market, snapshot, "best", lambda snapshot: snapshot.best_odds())
+
+    def arb_data(self, sport, market, snapshot):
+        if ODDS_ENGINE == "numpy":
+            return self.derived(sport, market, snapshot, "arb", lambda snapshot: self.board(sport, market, snapshot).arb_pairs())
+        return self.derived(sport, market, snapshot, "arb", lambda snapshot: snapshot.arb_pairs())
+
+    # columnar price arrays for the vectorized engine, built once per snapshot
+    def board(self, sport, market, snapshot):
+        return self.derived(sport, market, snapshot, "board", lambda snapshot: OddsBoard(snapshot))
+
+    # a stage's result for a cached snapshot, computed once per snapshot while it sits in L1 -
+    # concurrent requests on the same snapshot wait for the first computation instead of repeating it
+    def derived(self, sport, market, snapshot, stage, compute):
+        entry = self.l1_cache.peek((sport, market))
+        if entry is None or entry["snapshot"] is not snapshot:
+            with span(stage):
+                return compute(snapshot)
+        with entry["lock"]:
+            if stage not in entry["derived"]:
+                with span(stage):
+                    entry["derived"][stage] = compute(snapshot)
+        return entry["derived"][stage]
+
+    # arb_pairs for many (sport, market, snapshot) boards from the compute pool, one task per sport -
+    # {(sport, market): pairs}, left empty with COMPUTE_MODE "inline", below COMPUTE_MIN_LINES lines
+    # between the boards, or for a sport whose task failed; the caller computes those inline
+    async def pool_arbs(self, boards):
+        if self.compute is None or sum(len(game.lines) for _, _, snapshot in boards for game in snapshot.games) < COMPUTE_MIN_LINES:
+            return {}
+
+        by_sport = {}
+        for sport, market, snapshot in boards:
+            by_sport.setdefault(sport, []).append((market, snapshot))
+        with span("arb_pool"):
+            results = await asyncio.gather(*[
+                self.compute.arbs([self.encoded(sport, market, snapshot) for market, snapshot in group]) for sport, group in by_sport.items()
+            ], return_exceptions=True)
+
+        pooled = {}
+        for (sport, group), result in zip(by_sport.items(), results):
+            if isinstance(result, BaseException):
+                print(f"Compute pool failed for {sport}, computing inline: {result}")
+                continue
+            for (market, _), arbs in zip(group, result):
+                pooled[(sport, market)] = arbs
+        return pooled
+
+    # arbs for cached boards nobody has computed them for yet (written to Redis by another worker),
+    # from the compute pool into L1 for arb_data to pick up
+    async def precompute_arbs(self, boards):
+        if self.compute is None:
+            return
+
+        entries = {}
+        for sport, market, snapshot in boards:
+            entry = self.l1_cache.peek((sport, market))
+            if entry is not None and entry["snapshot"] is snapshot and "arb" not in entry["derived"]:
+                entries[(sport, market)] = entry
+
+        pooled = await self.pool_arbs([(sport, market, entry["snapshot"]) for (sport, market), entry in entries.items()])
+        for pair, arbs in pooled.items():
+            with entries[pair]["lock"]:
+                entries[pair]["derived"].setdefault("arb", arbs)
+
+    # a snapshot in its cached encoding - kept on its L1 entry from the Redis read or write when there was one
+    def encoded(self, sport, market, snapshot):
+        entry = self.l1_cache.peek((sport, market))
+        if entry is None or entry["snapshot"] is not snapshot:
+            return encode({"data": snapshot.to_processed()})
+        if entry["encoded"] is None:
+            entry["encoded"] = encode({"data": snapshot.to_processed()})
+        return entry["encoded"]
+
+    def set_l1_odds(self, sport, market, snapshot, encoded=None):
+        entry = {"version": snapshot.timestamp, "snapshot": snapshot, "derived": {}, "lock": threading.RLock(), "encoded": encoded}
+        self.l1_cache.set((sport, market), entry)
+        return entry
+
+    # read cached raw odds for many (sport, market) pairs: fresh L1 hits first, the rest in a single MGET;
+    # misses are left out
+    async def get_cached_odds_many(self, pairs):
+        cached_odds = {}
+        entries = {}
+        for pair in pairs:
+            entry = self.l1_cache.get(pair)
+            if entry and is_fresh(entry["snapshot"]):
+                cached_odds[pair] = entry["snapshot"]
+                cache_reads.inc(source="l1")
+            else:
+                entries[pair] = self.l1_cache.peek(pair)
+
+        pairs = [pair for pair in pairs if pair not in cached_odds]
+        keys = []
+        for sport, market in pairs:
+            cache_key = f'raw_odds_data_{sport}_{market}'
+            keys += [cache_key, f'{cache_key}_timestamp', f'{cache_key}_schedule']
+
+        values = []
+        if keys:
+            with span("redis_read"):
+                values = await self.redis_client.mget(keys)
+
+        for i, pair in enumerate(pairs):
+            cached, timestamp, schedule = values[3 * i:3 * i + 3]
+            if not cached:
+                continue
+            timestamp = timestamp.decode('utf-8') if timestamp else None
+
+            # same version already decoded in L1 - revalidated, no decode
+            entry = entries.get(pair)
+            if entry and timestamp and entry["version"] == timestamp:
+                self.l1_cache.set(pair, entry)
+                cached_odds[pair] = entry["snapshot"]
+                cache_reads.inc(source="revalidated")
+                continue
+
+            try:
+                with span("decode"):
+                    response = decode(cached)
+            except CodecError as e:
+                print(f"Discarding cached odds for {pair}: {e}")
+                continue
+            if isinstance(response, list):
+                response = {"data": response}  # Wrap list in a dictionary
+            with span("snapshot"):
+                snapshot = Snapshot.from_processed(response["data"], timestamp)
+            if schedule:
+                snapshot.schedule = Schedule.decode(schedule)
+            self.set_l1_odds(*pair, snapshot, cached)
+            cached_odds[pair] = snapshot
+            cache_reads.inc(source="redis")
+
+        return cached_odds
+
+    # write a freshly fetched Snapshot to the cache, stamped and scheduled - with window_end it only
+    # holds the games starting before then, and previous's later games are carried over
+    async def cache_odds(self, sport, market, snapshot, previous=None, window_end=None):
+        cache_key = f'raw_odds_data_{sport}_{market}'
+        timestamp_key = f'{cache_key}_timestamp'
+        schedule_key = f'{cache_key}_schedule'
+
+        fetched = snapshot
+        if window_end is not None:
+            snapshot = merge_window(fetched, previous, window_end)
+        snapshot.schedule = await self.scheduler.schedule(fetched, snapshot, previous, window_end is None)
+        expiry = timedelta(seconds=snapshot.schedule.ttl + CACHE_STALE_TTL)
+
+        # Dump raw odds json into Redis cache, kept past its TTL so it can be served stale while refreshing
+        with span("encode"):
+            encoded = encode({"data": snapshot.to_processed()})
+        current_timestamp = datetime.utcnow().isoformat()
+        with span("redis_write"):
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.setex(cache_key, expiry, encoded)
+                pipe.setex(timestamp_key, expiry, current_timestamp)
+                pipe.setex(schedule_key, expiry, snapshot.schedule.encode())
+                await pipe.execute()
+
+        snapshot.timestamp = current_timestamp
+        self.set_l1_odds(sport, market, snapshot, encoded)
+
+        # keep it for backtesting once it drops out of the cache, written off the request path
+        if self.history is not None:
+            self.executor.submit(self.record_history, snapshot)
+
+        return snapshot
+
+    # arbs for one fetch's freshly cached boards, computed in the compute pool when they're big
+    # enough - then diffed against the boards they replace, published and indexed
+    async def refresh_arbs(self, sport, snapshots, stale):
+        pooled = await self.pool_arbs([(sport, market, snapshot) for market, snapshot in snapshots.items()])
+        await asyncio.gather(*[
+            self.record_arbs(sport, market, snapshot, stale.get(market), pooled.get((sport, market))) for market, snapshot in snapshots.items()
+        ])
+
+    # keep a refreshed board's arbs in L1 with the delta against previous, and index them - pairs
+    # from the pool are diffed as they are, otherwise only the lines whose bookmakers updated are recomputed
+    async def record_arbs(self, sport, market, snapshot, previous, pairs):
+        expiry = timedelta(seconds=snapshot.schedule.ttl + CACHE_STALE_TTL)
+        delta = None
+        if INCREMENTAL_ARBS:
+            with span("arb_incremental"):
+                if pairs is None:
+                    pairs, delta = self.tracker.update(snapshot, previous)
+                else:
+                    delta = self.tracker.record(snapshot, previous, pairs)
+
+        # kept in L1, so the board's own /odds/arb requests and the index don't compute them again
+        entry = self.l1_cache.peek((sport, market))
+        if pairs is not None and entry is not None and entry["snapshot"] is snapshot:
+            with entry["lock"]:
+                entry["derived"].setdefault("arb", pairs)
+
+        if delta is not None:
+            await self.redis_client.setex(f'arb_delta_{sport}_{market}', expiry, encode(delta))
+            # every worker's stream clients get it, not just this one's
+            try:
+                await self.broadcaster.publish(delta)
+            except Exception as e:
+                print(f"Failed to publish arb delta: {e}")
+
+        # searchable by /odds/arb/search without anyone requesting the board
+        if self.arb_index is not None:
+            try:
+                await self.arb_index.update(snapshot, self.arb_data(sport, market, snapshot), expiry.total_seconds())
+            except Exception as e:
+                print(f"Failed to index arbs for {sport} {market}: {e}")
+
+    def record_history(self, snapshot):
+        try:
+            self.history.append(snapshot)
+        except Exception as e:
+            print(f"Failed to record history for {snapshot.sport} {snapshot.market}: {e}")
+
+    # indexed arbs matching an ArbFilter, best first
+    async def search(self, arb_filter, starts_within=None, limit=ARB_SEARCH_LIMIT):
+        return await self.arb_index.search(arb_filter, starts_within, limit)
+
+    # opened/changed/closed arbs from the last refresh of a sport/market, None if there wasn't one
+    async def delta(self, sport, market):
+        delta = await self.redis_client.get(f'arb_delta_{sport}_{market}')
+        if not delta:
+            return None
+        try:
+            return decode(delta)
+        except CodecError as e:
+            print(f"Discarding arb delta for {sport} {market}: {e}")
+            return None
+
+    # Log remaining requests - the key scheduler already recorded them and cools the key down at 0
+    def check_remaining_requests(self, snapshot):
+        remaining_requests = snapshot.remaining_requests
+        print(f"Remaining requests: {remaining_requests}")
+
+    # the upstream fetch (several markets in one call) on the event loop, parsed straight into Snapshots
+    async def async_get_odds_multi(self, sport, markets, commence_to=None):
+        try:
+            current_api_key = await self.keys.current()
+            if current_api_key is None:
+                return None
+            with span("fetch"):
+                return await fetch_odds(sport, current_api_key, markets, BOOKMAKERS, self.keys, parse_snapshots, commence_to)
+        except Exception as e:
+            print(f"Error fetching odds: {e}")
+            return None
+
+    # refresh a sport's markets with at most one upstream fetch per (sport, market) in flight:
+    # other callers get the stale copy if there is one, otherwise they wait for the fetch in progress
+    async def refresh_odds(self, sport, markets, stale, semaphore=None, timeout=None):
+        futures, owned = self.flights.claim([(sport, market) for market in markets])
+        owned = [market for _, market in owned]
+        refreshed = {}
+
+        if owned:
+            try:
+                refreshed = await self.fetch_and_cache_odds(sport, owned, stale, semaphore, timeout)
+            finally:
+                for market in owned:
+                    self.flights.resolve((sport, market), refreshed.get(market))
+
+        for market in markets:
+            if market in refreshed:
+                continue
+            if market in stale:
+                refreshed[market] = stale[market]
+                stale_served.inc()
+                continue
+            refreshed[market] = await self.flights.wait(futures[(sport, market)], CACHE_LOCK_WAIT)
+
+        return refreshed
+
+    # fetch markets and write them to the cache - a Redis lock per market keeps other workers
+    # from fetching the same data, they serve stale or wait for the lock holder's write instead
+    async def fetch_and_cache_odds(self, sport, markets, stale, semaphore=None, timeout=None):
+        results = {}
+        waiting = list(markets)
+        deadline = time.monotonic() + CACHE_LOCK_WAIT
+        # the locks this call takes hold its own token, so it only ever releases those
+        token = secrets.token_hex(16)
+
+        while waiting:
+            acquired = await asyncio.gather(*[
+                self.redis_client.set(f'raw_odds_data_{sport}_{market}_lock', token, nx=True, ex=CACHE_LOCK_TTL) for market in waiting
+            ])
+            locked = [market for market, lock in zip(waiting, acquired) if lock]
+            waiting = [market for market in waiting if market not in locked]
+
+            if locked:
+                try:
+                    # only the games inside FETCH_WINDOW when the cached boards hold recent later games
+                    window_end = self.scheduler.window_end(locked, stale)
+                    async with semaphore or contextlib.nullcontext():
+                        try:
+                            raw_odds = await asyncio.wait_for(self.async_get_odds_multi(sport, locked, window_end), timeout)
+                        except asyncio.TimeoutError:
+                            print(f"Timed out fetching odds for {sport}")
+                            raw_odds = None
+                    if raw_odds is not None:
+                        cached = await asyncio.gather(*[
+                            self.cache_odds(sport, market, raw_odds[market], stale.get(market), window_end) for market in locked
+                        ])
+                        results.update(zip(locked, cached))
+                        self.check_remaining_requests(results[locked[0]])
+                        await self.refresh_arbs(sport, dict(zip(locked, cached)), stale)
+                finally:
+                    await self.release_script(keys=[f'raw_odds_data_{sport}_{market}_lock' for market in locked], args=[token])
+
+            # another worker holds the lock: serve stale, or poll until it writes the cache
+            for market in [market for market in waiting if market in stale]:
+                results[market] = stale[market]
+                waiting.remove(market)
+                stale_served.inc()
+            if not waiting or time.monotonic() > deadline:
+                break
+            await asyncio.sleep(CACHE_LOCK_POLL)
+            cached_odds = await self.get_cached_odds_many([(sport, market) for market in waiting])
+            for (_, market), cached in cached_odds.items():
+                if is_fresh(cached):
+                    results[market] = cached
+                    waiting.remove(market)
+
+        return results
+
+    # raw odds for each market of a sport: fresh cache hits from L1/Redis, every miss refreshed in one request
+    async def get_sport_odds(self, sport, markets, cached_odds=None, semaphore=None, timeout=None):
+        if cached_odds is None:
+            cached_odds = await self.get_cached_odds_many([(sport, market) for market in markets])
+
+        raw_data = {}
+        stale = {}
+        for market in markets:
+            if REFRESH_AHEAD_ENABLED:
+                self.refresher.touch(sport, market)
+            cached = cached_odds.get((sport, market))
+            if cached and is_fresh(cached):
+                raw_data[market] = cached
+                cache_lookups.inc(result="hit")
+            elif cached:
+                stale[market] = cached
+                cache_lookups.inc(result="stale")
+            else:
+                cache_lookups.inc(result="miss")
+
+        missing = [market for market in markets if market not in raw_data]
+        if missing:
+            raw_data.update(await self.refresh_odds(sport, missing, stale, semaphore, timeout))
+            if any(raw_data[market] is None for market in missing):
+                return None
+
+        return raw_data
+
+    # refresh-ahead: re-fetch hot keys that expire within REFRESH_AHEAD seconds (half their TTL for
+    # short ones), one request per sport
+    async def refresh_hot_odds(self, pairs):
+        cached_odds = await self.get_cached_odds_many(pairs)
+        due = {}
+        for sport, market in pairs:
+            cached = cached_odds.get((sport, market))
+            if cached and is_fresh(cached, min(REFRESH_AHEAD, cache_ttl(cached) / 2)):
+                continue
+            due.setdefault(sport, {})[market] = cached
+
+        for sport, markets in due.items():
+            stale = {market: cached for market, cached in markets.items() if cached}
+            await self.refresh_odds(sport, list(markets), stale)
@@ -0,0 +1,92 @@
+import numpy as np
+
+from constants import *
+from odds import leg_bookmaker, normalize_bookmaker
+
+
+# most a leg can take: the feed's bet_limit, else the configured limit for its bookmaker (inf if none)
+def leg_limit(details):
+    limit = details.get("bet_limit")
+    if limit is None:
+        limit = BOOKMAKER_BET_LIMITS.get(leg_bookmaker(details), DEFAULT_BET_LIMIT)
+    return np.inf if limit is None else float(limit)
+
+
+# stakes for every arb_pairs entry at once, for the most guaranteed profit. An arb returns a fixed
+# margin per unit staked, split across its legs by implied probability, so filling the best margins
+# first - each up to what its legs' bet limits allow - until the bankroll runs out is the max-profit
+# allocation. With per-bookmaker balances the same greedy order is kept, also capped by what each
+# book has left. Stakes are rounded down to increment and an arb that stops paying once rounded is left out
+def allocate(entries, bankroll=BANKROLL, balances=None, increment=STAKE_INCREMENT):
+    balances = balances if balances is not None else BOOKMAKER_BALANCES
+    balances = {normalize_bookmaker(bookmaker): float(balance) for bookmaker, balance in balances.items()}
+    n = len(entries)
+
+    odds = np.array([[entry["outcome_a_details"]["odds"], entry["outcome_b_details"]["odds"]] for entry in entries], dtype=float).reshape(n, 2)
+    limits = np.array([[leg_limit(entry["outcome_a_details"]), leg_limit(entry["outcome_b_details"])] for entry in entries], dtype=float).reshape(n, 2)
+
+    implied = 1 / odds
+    arb_value = implied.sum(axis=1)
+    margin = 1 / arb_value - 1
+    # fraction of an arb's total stake on each leg, and the largest total its limits allow
+    share = implied / arb_value[:, None]
+    cap = np.minimum((limits / share).min(axis=1), bankroll)
+
+    order = np.argsort(-margin, kind="stable")
+    order = order[margin[order] > 0]
+
+    totals = np.zeros(n)
+    if not balances:
+        # each arb gets what the better ones left of the bankroll, up to its cap
+        filled = np.cumsum(cap[order]) - cap[order]
+        totals[order] = np.clip(bankroll - filled, 0, cap[order])
+    else:
+        remaining = bankroll
+        for i in order.tolist():
+            # fraction of the total drawn from each book - both legs can be on the same one
+            drawn = {}
+            for leg, details in enumerate((entries[i]["outcome_a_details"], entries[i]["outcome_b_details"])):
+                book = leg_bookmaker(details)
+                drawn[book] = drawn.get(book, 0) + share[i, leg].item()
+
+            total = min(cap[i].item(), remaining)
+            for book, fraction in drawn.items():
+                if book in balances:
+                    total = min(total, balances[book] / fraction)
+            if total <= 0:
+                continue
+
+            totals[i] = total
+            remaining -= total
+            for book, fraction in drawn.items():
+                if book in balances:
+                    balances[book] -= total * fraction
+            if remaining <= 0:
+                break
+
+    stakes = np.floor(totals[:, None] * share / increment) * increment
+    staked = stakes.sum(axis=1)
+    payout = (stakes * odds).min(axis=1)
+    profit = payout - staked
+    placed = (staked > 0) & (profit > 0)
+
+    allocations = []
+    for i in order.tolist():
+        if not placed[i]:
+            continue
+        allocations.append({**entries[i], "allocation": {
+            "outcome_a": round(stakes[i, 0].item(), 2),
+            "outcome_b": round(stakes[i, 1].item(), 2),
+            "total": round(staked[i].item(), 2),
+            "guaranteed_return": round(payout[i].item(), 2),
+            "profit": round(profit[i].item(), 2),
+        }})
+
+    total_staked = staked[placed].sum().item()
+    return {
+        "data": allocations,
+        "bankroll": bankroll,
+        "total_staked": round(total_staked, 2),
+        "unallocated": round(bankroll - total_staked, 2),
+        "guaranteed_profit": round(profit[placed].sum().item(), 2),
+    }
@@ -0,0 +1,108 @@
+import asyncio
+import json
+
+from constants import *
+from odds import arb_percent, leg_bookmaker, normalize_bookmaker
+
+
+# one connected client's filters - empty sets match everything
+class ArbFilter:
+    def __init__(self, sports=(), markets=(), bookmakers=(), kinds=(), min_arb=None):
+        self.sports = set(sports)
+        self.markets = set(markets)
+        self.bookmakers = {normalize_bookmaker(bookmaker) for bookmaker in bookmakers}
+        self.kinds = set(kinds)
+        self.min_arb = min_arb
+
+    def matches_board(self, delta):
+        return (not self.sports or delta["sport"] in self.sports) and (not self.markets or delta["market"] in self.markets)
+
+    def matches(self, entry):
+        if self.kinds and entry["kind"] not in self.kinds:
+            return False
+        if self.bookmakers:
+            # by Odds API key, the names in BOOKMAKERS, or by title
+            legs = set()
+            for details in (entry["outcome_a_details"], entry["outcome_b_details"]):
+                legs |= {leg_bookmaker(details), normalize_bookmaker(details["bookmaker"])}
+            if not legs & self.bookmakers:
+                return False
+        if self.min_arb is not None and arb_percent(entry) < self.min_arb:
+            return False
+        return True
+
+    # the part of a refresh delta this client asked for, None if nothing matches
+    def apply(self, delta):
+        if not self.matches_board(delta):
+            return None
+        filtered = {change: [entry for entry in delta[change] if self.matches(entry)] for change in ("opened", "changed", "closed")}
+        if not any(filtered.values()):
+            return None
+        return {"sport": delta["sport"], "market": delta["market"], "timestamp": delta["timestamp"], **filtered}
+
+
+# fans arb deltas published on Redis out to this worker's stream subscribers - one pub/sub
+# connection per worker however many clients are connected
+class ArbBroadcaster:
+    def __init__(self, redis_client, channel=ARB_STREAM_CHANNEL):
+        self.redis_client = redis_client
+        self.channel = channel
+        self.subscribers = {}
+        self.task = None
+
+    async def publish(self, delta):
+        if delta["opened"] or delta["changed"] or delta["closed"]:
+            await self.redis_client.publish(self.channel, json.dumps(delta))
+
+    def subscribe(self, arb_filter):
+        subscriber = asyncio.Queue(maxsize=ARB_STREAM_QUEUE_SIZE)
+        self.subscribers[subscriber] = arb_filter
+        # started lazily on the serving loop so it is never forked along with a preloaded app
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.pop(subscriber, None)
+
+    def broadcast(self, delta):
+        for subscriber, arb_filter in list(self.subscribers.items()):
+            event = arb_filter.apply(delta)
+            if event is None:
+                continue
+            try:
+                subscriber.put_nowait(event)
+            except asyncio.QueueFull:
+                # client isn't keeping up - drop it rather than buffer without bound, making
+                # room for the None that ends its stream
+                self.unsubscribe(subscriber)
+                subscriber.get_nowait()
+                subscriber.put_nowait(None)
+
+    async def run(self):
+        while True:
+            try:
+                pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+                await pubsub.subscribe(self.channel)
+                async for message in pubsub.listen():
+                    self.broadcast(json.loads(message["data"]))
+            except Exception as e:
+                print(f"Arb stream subscription failed: {e}")
+                await asyncio.sleep(1)
+
+    # Server-Sent Events for one client until it disconnects
+    async def events(self, arb_filter):
+        subscriber = self.subscribe(arb_filter)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(subscriber.get(), ARB_STREAM_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is None:
+                    return
+                yield f"event: arbs\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(subscriber)
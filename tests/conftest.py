@@ -0,0 +1,20 @@
+import os
+import sys
+
+# the app's modules live at the repo root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import *
+from models import Snapshot, parse_snapshots
+
+
+# one market of a raw /odds payload parsed the way the service parses upstream responses
+def board(raw, market, timestamp=None):
+    snapshot = parse_snapshots(raw, "icehockey_nhl", [market], BOOKMAKERS, "100")[market]
+    snapshot.timestamp = timestamp
+    return snapshot
+
+
+# the snapshot as another worker reads it back from Redis
+def cached(snapshot):
+    return Snapshot.from_processed(snapshot.to_processed(), snapshot.timestamp)
@@ -0,0 +1,43 @@
+import asyncio
+
+from cache import SingleFlight
+
+
+def test_waiter_timing_out_leaves_the_flight_to_its_owner():
+    async def run():
+        flights = SingleFlight()
+        futures, owned = flights.claim(["a", "b"])
+        assert owned == ["a", "b"]
+
+        # another caller gives up on "a" before the owner's fetch finishes
+        waiting, owned = flights.claim(["a"])
+        assert owned == []
+        assert await flights.wait(waiting["a"], 0.01) is None
+        assert not futures["a"].cancelled()
+
+        # a waiter that disconnects doesn't cancel it either
+        task = asyncio.ensure_future(flights.wait(waiting["a"], 10))
+        await asyncio.sleep(0)
+        task.cancel()
+        await asyncio.sleep(0)
+        assert not futures["a"].cancelled()
+
+        flights.resolve("a", "fresh")
+        flights.resolve("b", "fresh")
+        assert futures["a"].result() == futures["b"].result() == "fresh"
+
+        # both keys are free for the next refresh
+        _, owned = flights.claim(["a", "b"])
+        assert owned == ["a", "b"]
+
+    asyncio.run(run())
+
+
+def test_resolve_skips_a_future_that_is_already_done():
+    flights = SingleFlight()
+    futures, _ = flights.claim(["a"])
+    futures["a"].cancel()
+    flights.resolve("a", "fresh")
+    flights.resolve("a", "fresh")
+    _, owned = flights.claim(["a"])
+    assert owned == ["a"]
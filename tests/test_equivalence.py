@@ -0,0 +1,76 @@
+import random
+
+import pytest
+
+import odds
+from bench import fixtures
+from constants import *
+from conftest import board, cached
+from incremental import ArbTracker
+
+SEEDS = range(5)
+
+
+# synthetic payload with the feed's rough edges: bet limits on some outcomes, games nobody quotes
+# and bookmakers missing a market
+def payload(seed):
+    rnd = random.Random(seed)
+    raw = fixtures.synthetic(25, 9, 4, seed=seed)
+    for game in raw:
+        if rnd.random() < 0.1:
+            game["bookmakers"] = []
+        for bookmaker in game["bookmakers"]:
+            if rnd.random() < 0.1:
+                bookmaker["markets"] = bookmaker["markets"][1:]
+            for market in bookmaker["markets"]:
+                for outcome in market["outcomes"]:
+                    if rnd.random() < 0.3:
+                        outcome["bet_limit"] = rnd.choice([50, 250, 1000])
+    return raw
+
+
+# the dict-walk output every engine has to match, and the board as parsed and as read back from the cache
+def boards(seed, market):
+    raw = payload(seed)
+    processed = odds.format_odds(raw, "icehockey_nhl", [market], BOOKMAKERS, "100")[market]
+    best = odds.best_odds(processed)
+    parsed = board(raw, market)
+    return processed, best, odds.arb_pairs(best), parsed, cached(parsed)
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("market", MARKETS)
+def test_snapshot_matches_dict_walk(seed, market):
+    processed, best, pairs, parsed, from_cache = boards(seed, market)
+    assert parsed.to_processed() == processed
+    for snapshot in (parsed, from_cache):
+        assert snapshot.best_odds() == best
+        assert snapshot.arb_pairs() == pairs
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("market", MARKETS)
+def test_numpy_engine_matches_dict_walk(seed, market):
+    pytest.importorskip("numpy")
+    from engine import OddsBoard
+    _, best, pairs, parsed, from_cache = boards(seed, market)
+    for snapshot in (parsed, from_cache):
+        board = OddsBoard(snapshot)
+        assert board.arb_pairs() == pairs
+        assert board.best_odds() == best
+
+
+@pytest.mark.parametrize("seed", SEEDS)
+@pytest.mark.parametrize("market", MARKETS)
+def test_incremental_matches_dict_walk(seed, market):
+    _, _, pairs, parsed, _ = boards(seed, market)
+    _, _, next_pairs, next_parsed, _ = boards(seed + len(SEEDS), market)
+
+    tracker = ArbTracker()
+    assert tracker.update(parsed)[0] == pairs
+    # every line moved: a new slate replacing the last
+    assert tracker.update(next_parsed, parsed)[0] == next_pairs
+    # nothing moved: every line reused from the tracker's state
+    pairs_again, delta = tracker.update(cached(next_parsed), next_parsed)
+    assert pairs_again == next_pairs
+    assert delta["recomputed"] == 0
@@ -0,0 +1,113 @@
+import copy
+import random
+
+import orjson
+import pytest
+
+from bench import fixtures
+from constants import *
+from conftest import board, cached
+from incremental import ArbTracker
+
+
+# raw payload with a share of the bookmakers repriced and their last_update moved on
+def refreshed(raw, seed, share=0.3):
+    rnd = random.Random(seed)
+    raw = copy.deepcopy(raw)
+    for game in raw:
+        for bookmaker in game["bookmakers"]:
+            if rnd.random() > share:
+                continue
+            bookmaker["last_update"] = f"2024-12-01T11:{rnd.randint(0, 59):02d}:00Z"
+            for market in bookmaker["markets"]:
+                for outcome in market["outcomes"]:
+                    outcome["price"] = round(rnd.uniform(1.6, 2.5), 2)
+    return raw
+
+
+def without_counts(delta):
+    return {key: value for key, value in delta.items() if key != "recomputed"}
+
+
+@pytest.fixture
+def raws():
+    raw = fixtures.synthetic(30, 9, 3, seed=1)
+    first = refreshed(raw, 2)
+    return raw, first, refreshed(first, 3)
+
+
+@pytest.mark.parametrize("market", MARKETS)
+def test_unchanged_board_on_another_worker(raws, market):
+    raw = raws[0]
+    first = board(raw, market, "2024-12-01T10:00:00")
+    ArbTracker().update(first)
+
+    # a worker that never saw the board refreshes it with nothing changed
+    pairs, delta = ArbTracker().update(board(raw, market, "2024-12-01T10:05:00"), cached(first))
+    assert delta["opened"] == delta["changed"] == delta["closed"] == []
+    assert delta["recomputed"] == 0
+    assert pairs == first.arb_pairs()
+
+
+@pytest.mark.parametrize("market", MARKETS)
+def test_delta_is_the_same_on_every_worker(raws, market):
+    raw, first, _ = raws
+    a = board(raw, market, "2024-12-01T10:00:00")
+    b = board(first, market, "2024-12-01T10:05:00")
+
+    worker = ArbTracker()
+    worker.update(a)
+    pairs, delta = worker.update(b, a)
+    assert delta["opened"] or delta["changed"] or delta["closed"]
+
+    # no state at all, and state from a snapshot that isn't the one being replaced
+    fresh_pairs, fresh_delta = ArbTracker().update(board(first, market, "2024-12-01T10:05:00"), cached(a))
+    behind = ArbTracker()
+    behind.update(board(raw, market, "2024-12-01T09:55:00"))
+    behind_pairs, behind_delta = behind.update(board(first, market, "2024-12-01T10:05:00"), cached(a))
+
+    assert without_counts(fresh_delta) == without_counts(behind_delta) == without_counts(delta)
+    assert fresh_pairs == behind_pairs == pairs == b.arb_pairs()
+
+
+@pytest.mark.parametrize("market", MARKETS)
+def test_stale_worker_sees_closes_in_between(raws, market):
+    raw, first, second = raws
+    a = board(raw, market, "2024-12-01T10:00:00")
+    b = board(first, market, "2024-12-01T10:05:00")
+
+    # this worker refreshed a, then another worker replaced it with b
+    stale = ArbTracker()
+    stale.update(a)
+    other = ArbTracker()
+    other.update(a)
+    other.update(b, a)
+
+    _, expected = other.update(board(second, market, "2024-12-01T10:10:00"), b)
+    _, delta = stale.update(board(second, market, "2024-12-01T10:10:00"), cached(b))
+    assert without_counts(delta) == without_counts(expected)
+
+
+@pytest.mark.parametrize("market", MARKETS)
+def test_pool_results_diff_like_the_tracker(raws, market):
+    raw, first, second = raws
+    a = board(raw, market, "2024-12-01T10:00:00")
+
+    worker = ArbTracker()
+    worker.update(a)
+    b = board(first, market, "2024-12-01T10:05:00")
+    _, expected = worker.update(b, a)
+
+    # a worker whose compute pool produced b's arbs (round-tripped through JSON like the pool's results)
+    pooled = ArbTracker()
+    pooled_b = board(first, market, "2024-12-01T10:05:00")
+    delta = pooled.record(pooled_b, cached(a), orjson.loads(orjson.dumps(pooled_b.arb_pairs())))
+    assert without_counts(delta) == without_counts(expected)
+
+    # the next incremental refresh reuses what the pool produced
+    c = board(second, market, "2024-12-01T10:10:00")
+    _, expected = worker.update(c, b)
+    pairs, delta = pooled.update(board(second, market, "2024-12-01T10:10:00"), cached(pooled_b))
+    assert without_counts(delta) == without_counts(expected)
+    assert delta["recomputed"] == expected["recomputed"]
+    assert pairs == c.arb_pairs()
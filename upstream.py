@@ -0,0 +1,105 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+
+import httpx
+
+from constants import *
+from metrics import Histogram
+
+upstream_latency = Histogram(
+    "arbapi_upstream_request_seconds",
+    "Latency of requests to The Odds API, by response status",
+    ["status"],
+    )
+
+# one keep-alive client per event loop - reuses TLS connections to api.the-odds-api.com across
+# fetches, but a pooled connection can't move to another loop
+clients = weakref.WeakKeyDictionary()
+
+
+def client():
+    loop = asyncio.get_running_loop()
+    if loop not in clients:
+        clients[loop] = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=UPSTREAM_POOL_SIZE, max_keepalive_connections=UPSTREAM_POOL_SIZE),
+            timeout=httpx.Timeout(UPSTREAM_READ_TIMEOUT, connect=UPSTREAM_CONNECT_TIMEOUT),
+            )
+    return clients[loop]
+
+
+# drop the running loop's pooled connections
+async def close():
+    loop = asyncio.get_running_loop()
+    if loop in clients:
+        await clients.pop(loop).aclose()
+
+
+# caps retries to a fraction of recent requests so an upstream outage can't turn into a retry storm
+class RetryBudget:
+    def __init__(self, ratio, capacity):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+        self.lock = threading.Lock()
+
+    def deposit(self):
+        with self.lock:
+            self.tokens = min(self.tokens + self.ratio, self.capacity)
+
+    def withdraw(self):
+        with self.lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+retry_budget = RetryBudget(UPSTREAM_RETRY_RATIO, UPSTREAM_RETRY_CAPACITY)
+
+
+# exponential backoff with full jitter
+async def backoff(attempt):
+    await asyncio.sleep(random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * 2 ** attempt)))
+
+
+# GET from The Odds API with pooled connections, timeouts and retries on 5xx/connection errors;
+# with a KeyScheduler every response's quota is recorded against its key, and on 401/429 the
+# request moves to the scheduler's next key until it stops handing out untried ones
+async def get(url, params, keys=None):
+    tried_keys = {params.get("apiKey")}
+    attempt = 0
+    retry_budget.deposit()
+
+    while True:
+        start = time.perf_counter()
+        try:
+            response = await client().get(url, params=params)
+        except httpx.TransportError:
+            upstream_latency.observe(time.perf_counter() - start, status="error")
+            if attempt >= UPSTREAM_RETRIES or not retry_budget.withdraw():
+                raise
+            attempt += 1
+            await backoff(attempt)
+            continue
+
+        upstream_latency.observe(time.perf_counter() - start, status=response.status_code)
+        if keys is not None:
+            await keys.record(params.get("apiKey"), response)
+
+        if response.status_code in (401, 429) and keys is not None:
+            api_key = await keys.current()
+            if api_key is not None and api_key not in tried_keys:
+                print("API key rejected, retrying with next API key")
+                tried_keys.add(api_key)
+                params = {**params, "apiKey": api_key}
+                continue
+
+        elif response.status_code >= 500 and attempt < UPSTREAM_RETRIES and retry_budget.withdraw():
+            attempt += 1
+            await backoff(attempt)
+            continue
+
+        return response